@@ -1,12 +1,29 @@
 from flask import Flask
+from .resources import timed
 
 def create_app():
     app = Flask(__name__)
     app.config['UPLOAD_FOLDER'] = 'uploads'
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB file size limit
     
-    # Register routes
-    from .routes import main
+    # Register routes; spaCy is imported by them and timed on its own
+    with timed('import spacy'):
+        import spacy
+    with timed('import app.routes'):
+        from .routes import main
     app.register_blueprint(main)
+
+    @app.cli.command('warmup')
+    def warmup_command():
+        """Load every model and client and print how long each step took."""
+        from .resources import warmup
+        report = warmup()
+        for step in report['steps']:
+            print(f"{step['step']:<32}{step['seconds']:>8.2f}s")
+        for name, status in report['resources'].items():
+            if status['error']:
+                print(f"{name} failed: {status['error']}")
+        if not report['ready']:
+            raise SystemExit(1)
     
-    return app
\ No newline at end of file
+    return app
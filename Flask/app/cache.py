@@ -0,0 +1,105 @@
+"""
+Thread-safe in-process caches used on the request path
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """LRU cache with an optional time-to-live and hit/miss counters, safe across Flask threads."""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                expires_at, value = item
+                if expires_at is None or expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        expires_at = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the cached value, computing it outside the lock on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class ResponseCache(LRUCache):
+    """Full /chat answers for database-sourced questions, valid for one corpus version."""
+
+    def __init__(self, maxsize: int = 2048, ttl: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        super().__init__(maxsize, ttl, clock)
+        self.corpus_version = None
+
+    def _advance_version(self, corpus_version: int) -> None:
+        # Versions only move forward, so every entry from an older corpus is stale
+        if self.corpus_version is None or corpus_version > self.corpus_version:
+            with self._lock:
+                if self.corpus_version is None or corpus_version > self.corpus_version:
+                    self._data.clear()
+                    self.corpus_version = corpus_version
+
+    def lookup(self, question: str, corpus_version: int) -> Optional[Dict[str, Any]]:
+        self._advance_version(corpus_version)
+        if corpus_version != self.corpus_version:
+            return None
+        return self.get((question, corpus_version))
+
+    def store(self, question: str, corpus_version: int, response: Dict[str, Any]) -> None:
+        # A request that started before a training run finished must not repopulate the cache
+        if corpus_version == self.corpus_version:
+            self.put((question, corpus_version), response)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats['corpus_version'] = self.corpus_version
+        return stats
@@ -0,0 +1,489 @@
+"""
+Trained condition corpora: one MongoDB document per sentence, grouped into immutable versions,
+served from in-memory embedding indexes
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+import numpy as np
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from .embedding_cache import sentence_hash
+from .embeddings import encode_sentences
+from .retrieval import EmbeddingIndex, HybridScorer, CentroidTypeClassifier, IVFIndex
+
+logger = logging.getLogger(__name__)
+
+# Pointer document: which corpus version is active, the versions kept for rollback, and a
+# generation counter bumped on every activation or rollback so readers and caches reload
+GENERATION_DOC_ID = 'corpus_generation'
+# Sentences per page when streaming a corpus, and operations per bulk_write batch
+READ_PAGE_SIZE = 1000
+WRITE_BATCH_SIZE = 1000
+# Types with fewer conditions than this are searched exactly, without an approximate index
+ANN_EXACT_THRESHOLD = 2000
+
+
+class CorpusStore:
+    """Blue/green corpus versions over per-sentence documents.
+
+    Each sentence of a transaction type is one document in sentences_collection holding
+    its text, hash, source files, embedding and the corpus versions it belongs to. A
+    training run adds the new version to the sentences it keeps and inserts only new
+    ones, then a single update of the pointer document in collection makes it active.
+    Readers only ever see the active version, and the previous keep_versions - 1 stay
+    available for rollback.
+
+    Types with at least ann_threshold conditions also get an IVF index, whose centroids
+    are stored per version in collection next to the pointer document.
+    """
+
+    def __init__(self, collection, sbert_model, model_name: str,
+                 semantic_weight: float = 0.6, lexical_weight: float = 0.4,
+                 check_interval: float = 5.0, keep_versions: int = 3,
+                 sentences_collection=None, page_size: int = READ_PAGE_SIZE,
+                 ann_threshold: int = ANN_EXACT_THRESHOLD, ann_nlist: Optional[int] = None,
+                 ann_nprobe: int = 8, bm25_depth: int = 300):
+        self.collection = collection
+        if sentences_collection is None:
+            sentences_collection = collection.database[f"{collection.name}_sentences"]
+        self.sentences = sentences_collection
+        self.page_size = page_size
+        self.sbert_model = sbert_model
+        self.model_name = model_name
+        self.semantic_weight = semantic_weight
+        self.lexical_weight = lexical_weight
+        self.check_interval = check_interval
+        self.keep_versions = max(1, keep_versions)
+        self.ann_threshold = ann_threshold
+        # None picks about 4 * sqrt(n) lists per type
+        self.ann_nlist = ann_nlist
+        self.ann_nprobe = ann_nprobe
+        # BM25 candidates reranked per query; 0 scores every condition (or the IVF lists) instead
+        self.bm25_depth = bm25_depth
+        # transaction type -> scorer (None when the type has no trained conditions)
+        self._scorers: Dict[str, Optional[HybridScorer]] = {}
+        # transaction type -> generation the cached scorer was loaded at
+        self._generations: Dict[str, int] = {}
+        self._classifier: Optional[CentroidTypeClassifier] = None
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._indexes_ready = False
+        self.version = 0
+        # Corpus version being served; None for corpora trained before versioning
+        self.active_version: Optional[int] = None
+
+    def current_version(self) -> int:
+        """Corpus generation, re-read from MongoDB at most once per check interval."""
+        return self._pointer()[0]
+
+    def _pointer(self) -> Tuple[int, Optional[int]]:
+        """(generation, active corpus version), read together so they always match."""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self.version, self.active_version
+        self._checked_at = now
+        try:
+            doc = self.collection.find_one({'id': GENERATION_DOC_ID}, {'generation': 1, 'active_version': 1})
+        except Exception as e:
+            print(f"Error reading corpus generation, serving cached corpus: {e}")
+            return self.version, self.active_version
+        generation = doc.get('generation', 0) if doc else 0
+        if generation != self.version:
+            with self._lock:
+                self.version = generation
+                self.active_version = doc.get('active_version') if doc else None
+                self._classifier = None
+        return self.version, self.active_version
+
+    def ensure_indexes(self) -> None:
+        """Indexes behind the active-version reads, incremental writes and the pointer lookup."""
+        if self._indexes_ready:
+            return
+        self.sentences.create_index([('transaction_type', ASCENDING), ('hash', ASCENDING)], unique=True)
+        # Paginated reads of one type in one version, in _id order
+        self.sentences.create_index([('transaction_type', ASCENDING), ('versions', ASCENDING), ('_id', ASCENDING)])
+        self.sentences.create_index([('versions', ASCENDING)])
+        self.collection.create_index([('transaction_type', ASCENDING), ('corpus_version', ASCENDING)])
+        self.collection.create_index([('id', ASCENDING)])
+        self.collection.create_index([('transaction_type', ASCENDING), ('ann_version', ASCENDING)])
+        self._indexes_ready = True
+
+    def build_index(self, sentences: List[str], transaction_type: Optional[str] = None) -> EmbeddingIndex:
+        """Embeddings for every condition, ready to be written.
+
+        With transaction_type, embeddings already stored for the same sentences and model
+        are reused, so an incremental run only encodes new sentences. Sentences shared with
+        other types or earlier corpora come from the disk embedding cache instead.
+        """
+        sentences = list(sentences)
+        stored = self._stored_embeddings(transaction_type, sentences) if transaction_type and sentences else {}
+        missing = [s for s in sentences if sentence_hash(s) not in stored]
+        if len(missing) == len(sentences):
+            return EmbeddingIndex(sentences, encode_sentences(self.sbert_model, sentences, store=True))
+        encoded = dict(zip(missing, encode_sentences(self.sbert_model, missing, store=True))) if missing else {}
+        vectors = [encoded[s] if s in encoded else stored[sentence_hash(s)] for s in sentences]
+        return EmbeddingIndex(sentences, np.vstack(vectors))
+
+    def build_ann(self, index: EmbeddingIndex) -> Optional[IVFIndex]:
+        """Attach an IVF index to a large enough index and log its measured recall."""
+        if len(index) < self.ann_threshold:
+            index.ann = None
+            return None
+        start = time.perf_counter()
+        index.ann = IVFIndex.build(index.embeddings, self.ann_nlist)
+        recall = index.ann.measure_recall(index.embeddings, self.ann_nprobe)
+        logger.info(
+            f"IVF index over {len(index)} conditions: {index.ann.nlist} lists, recall@10 {recall:.3f} "
+            f"at nprobe {self.ann_nprobe}, built in {time.perf_counter() - start:.2f}s"
+        )
+        return index.ann
+
+    def _scorer(self, index: EmbeddingIndex) -> HybridScorer:
+        return HybridScorer(index, self.semantic_weight, self.lexical_weight, nprobe=self.ann_nprobe,
+                            bm25_depth=self.bm25_depth)
+
+    def _find_by_hash(self, transaction_type: str, sentences: List[str], projection: Dict) -> Iterator[Dict]:
+        """Stored sentence documents of this model among the given sentences, queried in pages of hashes."""
+        hashes = [sentence_hash(s) for s in sentences]
+        for start in range(0, len(hashes), self.page_size):
+            yield from self.sentences.find(
+                {'transaction_type': transaction_type, 'hash': {'$in': hashes[start:start + self.page_size]},
+                 'embedding_model': self.model_name},
+                dict(projection, _id=0, hash=1)
+            )
+
+    def _stored_embeddings(self, transaction_type: str, sentences: List[str]) -> Dict[str, np.ndarray]:
+        stored = {}
+        try:
+            projection = {'embedding': 1, 'embedding_dim': 1, 'embedding_model': 1}
+            for doc in self._find_by_hash(transaction_type, sentences, projection):
+                vector = self._stored_vector(doc)
+                if vector is not None:
+                    stored[doc['hash']] = vector
+        except Exception as e:
+            print(f"Error reading stored embeddings for {transaction_type}, encoding all sentences: {e}")
+            return {}
+        return stored
+
+    def begin_version(self) -> int:
+        """Reserve the number of a new, not yet active, corpus version."""
+        self.ensure_indexes()
+        doc = self.collection.find_one_and_update(
+            {'id': GENERATION_DOC_ID},
+            {'$inc': {'next_version': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc['next_version']
+
+    def write_version(self, version: int, indexes: Dict[str, EmbeddingIndex],
+                      sources: Optional[Dict[str, Dict[str, Set[str]]]] = None, progress=None) -> None:
+        """Add every sentence of one version with batched writes; readers cannot see it yet.
+
+        Stored sentences whose sources did not change only gain the version, with one
+        update_many per page of hashes; new sentences are inserted and changed ones
+        rewritten (with their embedding when the model changed). sources maps
+        type -> sentence -> file names.
+        """
+        sources = sources or {}
+        total = sum(len(index.sentences) for index in indexes.values())
+        done = 0
+        requests = []
+        for transaction_type, index in indexes.items():
+            type_sources = sources.get(transaction_type, {})
+            # Sources of the sentences whose embedding for this model is already stored
+            stored = {
+                doc['hash']: doc.get('sources')
+                for doc in self._find_by_hash(transaction_type, index.sentences, {'sources': 1})
+            }
+            carried = []
+            for sentence, vector in zip(index.sentences, index.embeddings):
+                digest = sentence_hash(sentence)
+                sentence_sources = sorted(type_sources.get(sentence, []))
+                if stored.get(digest) == sentence_sources:
+                    carried.append(digest)
+                    continue
+                update = {
+                    '$addToSet': {'versions': version},
+                    '$set': {'sources': sentence_sources},
+                    '$setOnInsert': {'text': sentence}
+                }
+                if digest not in stored:
+                    update['$set'].update({
+                        'embedding': vector.astype(np.float32).tobytes(),
+                        'embedding_dim': index.dim,
+                        'embedding_model': self.model_name
+                    })
+                requests.append(UpdateOne({'transaction_type': transaction_type, 'hash': digest}, update, upsert=True))
+            for start in range(0, len(carried), self.page_size):
+                page = carried[start:start + self.page_size]
+                self.sentences.update_many(
+                    {'transaction_type': transaction_type, 'hash': {'$in': page}},
+                    {'$addToSet': {'versions': version}}
+                )
+                done += len(page)
+                if progress is not None:
+                    progress(done, total)
+        for start in range(0, len(requests), WRITE_BATCH_SIZE):
+            batch = requests[start:start + WRITE_BATCH_SIZE]
+            self.sentences.bulk_write(batch, ordered=False)
+            done += len(batch)
+            if progress is not None:
+                progress(done, total)
+        for transaction_type, index in indexes.items():
+            if index.ann is not None:
+                # Only the centroids are stored; readers rebuild the lists in one assignment pass
+                self.collection.replace_one(
+                    {'transaction_type': transaction_type, 'ann_version': version},
+                    {
+                        'transaction_type': transaction_type,
+                        'ann_version': version,
+                        'centroids': index.ann.centroids.tobytes(),
+                        'nlist': index.ann.nlist,
+                        'embedding_dim': index.dim,
+                        'embedding_model': self.model_name,
+                        'recall': index.ann.recall,
+                        'recall_nprobe': index.ann.recall_nprobe
+                    },
+                    upsert=True
+                )
+
+    def activate(self, version: int, indexes: Optional[Dict[str, EmbeddingIndex]] = None) -> int:
+        """Atomically make a written version active, then drop versions beyond the retention window.
+
+        indexes, when given, are the ones just written, so this process serves them
+        without reading them back.
+        """
+        doc = self.collection.find_one_and_update(
+            {'id': GENERATION_DOC_ID},
+            {
+                '$set': {'active_version': version},
+                '$inc': {'generation': 1},
+                '$push': {'versions': {'$each': [version], '$slice': -self.keep_versions}}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._switch(doc, indexes)
+        self._prune(doc.get('versions', [version]), version)
+        return doc['generation']
+
+    def rollback(self, version: Optional[int] = None) -> int:
+        """Serve a kept version again (by default the one before the active version)."""
+        doc = self.collection.find_one({'id': GENERATION_DOC_ID}) or {}
+        kept = doc.get('versions', [])
+        active = doc.get('active_version')
+        if version is None:
+            older = [v for v in kept if active is not None and v < active]
+            if not older:
+                raise ValueError('No earlier corpus version is kept.')
+            version = max(older)
+        if version not in kept:
+            raise ValueError(f"Corpus version {version} is not kept; available: {kept}")
+        doc = self.collection.find_one_and_update(
+            {'id': GENERATION_DOC_ID},
+            {'$set': {'active_version': version}, '$inc': {'generation': 1}},
+            return_document=ReturnDocument.AFTER
+        )
+        self._switch(doc)
+        return doc['generation']
+
+    def versions(self) -> Dict:
+        """Active version, kept versions and their transaction types."""
+        doc = self.collection.find_one({'id': GENERATION_DOC_ID}) or {}
+        kept = doc.get('versions', [])
+        types = {version: self._types_in(version) for version in kept}
+        return {
+            'generation': doc.get('generation', 0),
+            'active_version': doc.get('active_version'),
+            'versions': [{'version': version, 'transaction_types': sorted(types[version])} for version in kept]
+        }
+
+    def _switch(self, doc: Dict, indexes: Optional[Dict[str, EmbeddingIndex]] = None) -> None:
+        with self._lock:
+            self.version = doc['generation']
+            self.active_version = doc['active_version']
+            self._checked_at = time.monotonic()
+            self._classifier = None
+            if indexes is None:
+                # Loaded lazily from the newly active version
+                self._generations = {}
+            else:
+                # This process wrote the corpus it holds, so it is already current
+                self._scorers = {t_type: self._scorer(index) for t_type, index in indexes.items()}
+                self._generations = {t_type: self.version for t_type in self._scorers}
+
+    def _prune(self, kept: List[int], active: int) -> None:
+        """Drop versions outside the retention window, including failed runs and pre-versioning corpora."""
+        kept = list(set(kept) | {active})
+        try:
+            self.sentences.update_many(
+                {'versions': {'$elemMatch': {'$nin': kept}}},
+                {'$pull': {'versions': {'$nin': kept}}}
+            )
+            self.sentences.delete_many({'versions': {'$size': 0}})
+            # Whole-array corpora written before per-sentence storage
+            self.collection.delete_many({'conditions': {'$exists': True}, 'corpus_version': {'$nin': kept}})
+            self.collection.delete_many({'ann_version': {'$exists': True, '$nin': kept}})
+        except Exception as e:
+            print(f"Error pruning old corpus versions, they will be removed after the next run: {e}")
+
+    def get(self, transaction_type: str) -> Optional[EmbeddingIndex]:
+        scorer = self.get_scorer(transaction_type)
+        return scorer.index if scorer is not None else None
+
+    def get_scorer(self, transaction_type: str) -> Optional[HybridScorer]:
+        """Hybrid scorer fitted once per corpus generation; the last good copy is kept if MongoDB is unreachable."""
+        version, active_version = self._pointer()
+        if self._generations.get(transaction_type) == version:
+            return self._scorers.get(transaction_type)
+        try:
+            index = self._load(transaction_type, active_version)
+        except Exception as e:
+            print(f"Error querying MongoDB for {transaction_type}, serving last good copy: {e}")
+            return self._scorers.get(transaction_type)
+        scorer = self._scorer(index) if index is not None else None
+        return self._install(transaction_type, scorer, version)
+
+    def loaded_at(self, transaction_type: str) -> Optional[int]:
+        """Generation the type's scorer was loaded at; a failed load leaves the previous one (or None)."""
+        return self._generations.get(transaction_type)
+
+    def retrieval_stats(self) -> Dict:
+        """Per loaded type: size, candidate stages in use and conditions scored per query."""
+        with self._lock:
+            scorers = dict(self._scorers)
+        stats = {}
+        for t_type, scorer in scorers.items():
+            if scorer is None:
+                continue
+            ann = scorer.index.ann
+            stats[t_type] = {
+                'conditions': len(scorer.index),
+                'candidates': '+'.join(stage for stage, used in (('bm25', scorer.bm25), ('ivf', ann)) if used is not None) or 'exact',
+                'nlist': ann.nlist if ann is not None else None,
+                'nprobe': scorer.nprobe if ann is not None else None,
+                'recall': round(ann.recall, 3) if ann is not None and ann.recall is not None else None,
+                'recall_nprobe': ann.recall_nprobe if ann is not None else None,
+                'bm25_depth': scorer.bm25_depth if scorer.bm25 is not None else None,
+                'queries': scorer.queries,
+                'mean_candidates': round(scorer.candidates_scored / scorer.queries, 1) if scorer.queries else None
+            }
+        return stats
+
+    def transaction_types(self) -> List[str]:
+        _, active_version = self._pointer()
+        try:
+            return self._types_in(active_version)
+        except Exception as e:
+            print(f"Error listing transaction types from MongoDB: {e}")
+            return sorted(t_type for t_type, scorer in self._scorers.items() if scorer is not None)
+
+    def type_classifier(self, min_score: float = 0.2) -> CentroidTypeClassifier:
+        """Centroid classifier over every trained type, rebuilt when the corpus generation changes."""
+        self.current_version()
+        classifier = self._classifier
+        if classifier is None or classifier.min_score != min_score:
+            indexes = {t_type: self.get(t_type) for t_type in self.transaction_types()}
+            classifier = CentroidTypeClassifier(indexes, min_score)
+            self._classifier = classifier
+        return classifier
+
+    def _install(self, transaction_type: str, scorer: Optional[HybridScorer], version: int) -> Optional[HybridScorer]:
+        with self._lock:
+            self._scorers[transaction_type] = scorer
+            self._generations[transaction_type] = version
+            self._classifier = None
+        return scorer
+
+    def _types_in(self, version: Optional[int]) -> List[str]:
+        types = set()
+        if version is not None:
+            types.update(self.sentences.distinct('transaction_type', {'versions': version}))
+        types.update(self.collection.distinct('transaction_type', _array_version_filter(version)))
+        return sorted(t_type for t_type in types if t_type)
+
+    def iter_sentences(self, transaction_type: str, version: int) -> Iterator[Dict]:
+        """Stream the sentence documents of one type in one version, a page at a time in _id order."""
+        projection = {'text': 1, 'embedding': 1, 'embedding_dim': 1, 'embedding_model': 1}
+        query = {'transaction_type': transaction_type, 'versions': version}
+        last_id = None
+        while True:
+            page_query = dict(query, _id={'$gt': last_id}) if last_id is not None else query
+            page = list(self.sentences.find(page_query, projection).sort('_id', ASCENDING).limit(self.page_size))
+            yield from page
+            if len(page) < self.page_size:
+                return
+            last_id = page[-1]['_id']
+
+    def _load(self, transaction_type: str, active_version: Optional[int]) -> Optional[EmbeddingIndex]:
+        sentences = []
+        vectors = []
+        if active_version is not None:
+            for doc in self.iter_sentences(transaction_type, active_version):
+                sentences.append(doc['text'])
+                vectors.append(self._stored_vector(doc))
+        if not sentences:
+            sentences, vectors = self._load_arrays(transaction_type, active_version)
+        if not sentences:
+            return None
+
+        # Sentences stored without an embedding for this model are encoded once, then kept in memory
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            encoded = encode_sentences(self.sbert_model, [sentences[i] for i in missing], store=True)
+            for row, i in enumerate(missing):
+                vectors[i] = encoded[row]
+        index = EmbeddingIndex(sentences, np.vstack(vectors))
+        if len(index) >= self.ann_threshold:
+            index.ann = self._load_ann(transaction_type, active_version, index)
+        return index
+
+    def _load_ann(self, transaction_type: str, version: Optional[int], index: EmbeddingIndex) -> Optional[IVFIndex]:
+        """The stored IVF index of this version, or a new one for corpora trained without it."""
+        doc = None
+        if version is not None:
+            doc = self.collection.find_one({'transaction_type': transaction_type, 'ann_version': version})
+        if doc and doc.get('embedding_model') == self.model_name and doc.get('embedding_dim') == index.dim:
+            ann = IVFIndex.from_centroids(EmbeddingIndex.vectors_from_bytes(doc['centroids'], doc['embedding_dim']),
+                                          index.embeddings)
+            ann.recall = doc.get('recall')
+            ann.recall_nprobe = doc.get('recall_nprobe')
+            return ann
+        return self.build_ann(index)
+
+    def _stored_vector(self, doc: Dict) -> Optional[np.ndarray]:
+        if doc.get('embedding_model') == self.model_name and doc.get('embedding'):
+            return EmbeddingIndex.vectors_from_bytes(doc['embedding'], doc['embedding_dim'])[0]
+        return None
+
+    def _load_arrays(self, transaction_type: str, active_version: Optional[int]) -> Tuple[List[str], List]:
+        """Corpora stored as one conditions array per type, from before per-sentence documents."""
+        query = {'transaction_type': transaction_type}
+        query.update(_array_version_filter(active_version))
+        sentences = []
+        vectors = []
+        seen = set()
+        for item in self.collection.find(query):
+            conditions = item.get('conditions', [])
+            stored = None
+            if item.get('embedding_model') == self.model_name and item.get('embeddings'):
+                stored = EmbeddingIndex.vectors_from_bytes(item['embeddings'], item['embedding_dim'])
+                if len(stored) != len(conditions):
+                    stored = None
+            for i, condition in enumerate(conditions):
+                if condition in seen:
+                    continue
+                seen.add(condition)
+                sentences.append(condition)
+                vectors.append(stored[i] if stored is not None else None)
+        return sentences, vectors
+
+
+def _array_version_filter(active_version: Optional[int]) -> Dict:
+    # Corpora written before versioning have no corpus_version and stay readable until the first versioned run
+    if active_version is None:
+        return {'corpus_version': {'$exists': False}}
+    return {'corpus_version': active_version}
@@ -0,0 +1,337 @@
+"""
+Persistent local mirror of the Dropbox training folder for incremental training
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+import dropbox
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction/preprocessing changes so cached per-file sentences are rebuilt
+MANIFEST_VERSION = 2
+MANIFEST_NAME = 'manifest.json'
+
+
+# Errors worth retrying: Dropbox 5xx / rate limiting and dropped connections
+TRANSIENT_ERRORS = (
+    dropbox.exceptions.InternalServerError,
+    dropbox.exceptions.RateLimitError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError
+)
+
+
+class DownloadResult(NamedTuple):
+    path: str
+    local_path: str
+    bytes: int
+    seconds: float
+    attempts: int
+    error: Optional[str] = None
+
+
+class SyncResult(NamedTuple):
+    changed: List[str]
+    unchanged: List[str]
+    deleted: List[str]
+    downloads: List[DownloadResult] = []
+
+
+def list_folder_files(client, folder_path: str) -> List[dropbox.files.FileMetadata]:
+    """List every file in a folder, following files_list_folder_continue until has_more is false."""
+    result = client.files_list_folder(folder_path)
+    entries = list(result.entries)
+    while result.has_more:
+        result = client.files_list_folder_continue(result.cursor)
+        entries.extend(result.entries)
+    return [entry for entry in entries if isinstance(entry, dropbox.files.FileMetadata)]
+
+
+def _stream_to_file(client, path: str, local_path: str, chunk_size: int) -> int:
+    """Write a download to disk chunk by chunk; the file only appears once complete."""
+    partial_path = local_path + '.part'
+    _, response = client.files_download(path)
+    written = 0
+    try:
+        with open(partial_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+        os.replace(partial_path, local_path)
+    except Exception:
+        # A retry starts over, and a download that gives up leaves nothing behind
+        _remove_quietly(partial_path)
+        raise
+    finally:
+        response.close()
+    return written
+
+
+def download_file(client, path: str, local_path: str, chunk_size: int = 1024 * 1024,
+                  retries: int = 3, backoff: float = 0.5) -> DownloadResult:
+    """Stream one file to disk, retrying transient errors with exponential backoff."""
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            written = _stream_to_file(client, path, local_path, chunk_size)
+            return DownloadResult(path, local_path, written, time.monotonic() - start, attempt)
+        except TRANSIENT_ERRORS as e:
+            if attempt > retries:
+                return DownloadResult(path, local_path, 0, time.monotonic() - start, attempt, str(e))
+            # Dropbox tells us how long to wait when rate limited
+            delay = getattr(e, 'backoff', None) or backoff * 2 ** (attempt - 1)
+            logger.warning(f"Transient error downloading {path} (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+        except Exception as e:
+            return DownloadResult(path, local_path, 0, time.monotonic() - start, attempt, str(e))
+
+
+def download_files(client, jobs: List[Tuple[str, str]], max_workers: int = 4, chunk_size: int = 1024 * 1024,
+                   retries: int = 3, backoff: float = 0.5,
+                   on_result: Optional[Callable[[DownloadResult], None]] = None) -> List[DownloadResult]:
+    """Download (dropbox path, local path) pairs with a bounded thread pool, logging per-file timings.
+
+    on_result is called from the worker threads as each download finishes.
+    """
+    if not jobs:
+        return []
+
+    def run(job: Tuple[str, str]) -> DownloadResult:
+        result = download_file(client, job[0], job[1], chunk_size, retries, backoff)
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as pool:
+        results = list(pool.map(run, jobs))
+    for result in results:
+        if result.error:
+            logger.error(f"Failed to download {result.path} after {result.attempts} attempts: {result.error}")
+        else:
+            logger.info(f"Downloaded {result.path}: {result.bytes} bytes in {result.seconds:.2f}s")
+    return results
+
+
+class DropboxMirror:
+    """Local copy of a Dropbox folder tracked by content_hash and rev, with cached per-file sentences."""
+
+    def __init__(self, client, local_dir: str, quota_bytes: Optional[int] = None,
+                 download_workers: int = 4, chunk_size: int = 1024 * 1024, retries: int = 3,
+                 segmenter: str = 'sentencizer'):
+        self.client = client
+        # Cached sentences are only reused when they were split the same way
+        self.segmenter = segmenter
+        self.download_workers = download_workers
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.local_dir = local_dir
+        self.files_dir = os.path.join(local_dir, 'files')
+        self.sentences_dir = os.path.join(local_dir, 'sentences')
+        self.quota_bytes = quota_bytes
+        os.makedirs(self.files_dir, exist_ok=True)
+        os.makedirs(self.sentences_dir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    @property
+    def files(self) -> Dict[str, Dict]:
+        return self.manifest['files']
+
+    def _load_manifest(self) -> Dict:
+        path = os.path.join(self.local_dir, MANIFEST_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+            logger.info("Training mirror manifest is from an older format, rebuilding it.")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read training mirror manifest, rebuilding it: {e}")
+        return {'version': MANIFEST_VERSION, 'files': {}, 'trained_fingerprint': None}
+
+    def reload_manifest(self) -> None:
+        """Pick up changes another process made to the mirror (training in another worker)."""
+        self.manifest = self._load_manifest()
+
+    def save_manifest(self) -> None:
+        path = os.path.join(self.local_dir, MANIFEST_NAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, path)
+
+    def list_remote(self, folder_path: str) -> List[dropbox.files.FileMetadata]:
+        return list_folder_files(self.client, folder_path)
+
+    def sync(self, folder_path: str,
+             select: Optional[Callable[[List[dropbox.files.FileMetadata]], List[dropbox.files.FileMetadata]]] = None,
+             progress: Optional[Callable[..., None]] = None) -> SyncResult:
+        """Download only new or changed files and drop files deleted from Dropbox.
+
+        select narrows the listing to the files worth mirroring; files it leaves out
+        are treated like deleted ones. progress(stage, done, total) is told about the
+        'listing' and 'downloading' stages.
+        """
+        progress = progress or no_progress
+        progress('listing')
+        entries = self.list_remote(folder_path)
+        if select is not None:
+            entries = select(entries)
+        unchanged, to_download = [], []
+        for entry in entries:
+            record = self.files.get(entry.path_lower)
+            if record and record.get('sentences_file') == self._sentences_file(entry.content_hash):
+                # Same content and segmenter: a new rev alone (rename, restore) needs no download
+                record['rev'] = entry.rev
+                unchanged.append(entry.path_lower)
+                continue
+            to_download.append(entry)
+
+        progress('listing', len(entries), len(entries))
+        progress('downloading', 0, len(to_download))
+        finished = []
+
+        def downloaded(_result: DownloadResult) -> None:
+            finished.append(_result)
+            progress('downloading', len(finished), len(to_download))
+
+        downloads = download_files(
+            self.client,
+            [(entry.path_lower, os.path.join(self.files_dir, entry.name)) for entry in to_download],
+            max_workers=self.download_workers, chunk_size=self.chunk_size, retries=self.retries,
+            on_result=downloaded
+        )
+        changed = []
+        for entry, download in zip(to_download, downloads):
+            if download.error:
+                # Keep any previous record (and its sentences) so the next sync retries the file
+                continue
+            previous = self.files.get(entry.path_lower)
+            if previous and not previous.get('sentences_file'):
+                # Never extracted since an earlier sync: keep the last version that was
+                previous = previous.get('previous')
+            # The previous record (and its sentences) stays until the new content is
+            # extracted, so a failed extraction can fall back to it
+            self.files[entry.path_lower] = {
+                'name': entry.name,
+                'rev': entry.rev,
+                'content_hash': entry.content_hash,
+                'size': entry.size,
+                'local_path': download.local_path,
+                'sentences_file': None,
+                'last_used': time.time(),
+                'previous': previous
+            }
+            changed.append(entry.path_lower)
+
+        remote_paths = {entry.path_lower for entry in entries}
+        deleted = [path for path in self.files if path not in remote_paths]
+        for path in deleted:
+            self._forget(path)
+        self.save_manifest()
+        return SyncResult(changed, unchanged, deleted, downloads)
+
+    def _forget(self, path: str) -> None:
+        record = self.files.pop(path)
+        self._remove_local(record)
+        self._release_sentences(record.get('sentences_file'))
+        self._release_previous(record)
+
+    def _release_previous(self, record: Dict) -> None:
+        previous = record.pop('previous', None)
+        if previous:
+            self._release_sentences(previous.get('sentences_file'))
+
+    def _release_sentences(self, sentences_file: Optional[str]) -> None:
+        """Delete a cached sentence file once no mirrored file (or pending previous version) refers to it."""
+        if not sentences_file:
+            return
+        for record in self.files.values():
+            if sentences_file in (record.get('sentences_file'), (record.get('previous') or {}).get('sentences_file')):
+                return
+        _remove_quietly(os.path.join(self.sentences_dir, sentences_file))
+
+    def extraction_failed(self, path: str) -> None:
+        """Go back to the last successfully extracted version of a file, like a failed download.
+
+        Its content hash then differs from Dropbox again, so the next sync retries the file;
+        a file that was never extracted is dropped until then.
+        """
+        record = self.files.pop(path)
+        previous = record.get('previous')
+        if previous:
+            self.files[path] = previous
+        else:
+            self._remove_local(record)
+
+    def _remove_local(self, record: Dict) -> None:
+        if record.get('local_path'):
+            _remove_quietly(record['local_path'])
+            record['local_path'] = None
+
+    def local_path(self, path: str) -> Optional[str]:
+        return self.files[path].get('local_path')
+
+    def _sentences_file(self, content_hash: str) -> str:
+        return f"{content_hash}-{self.segmenter}.json"
+
+    def store_sentences(self, path: str, sentences: List[str]) -> None:
+        """Cache the sentences extracted from one file, keyed by its content hash and the segmenter."""
+        record = self.files[path]
+        sentences_file = self._sentences_file(record['content_hash'])
+        with open(os.path.join(self.sentences_dir, sentences_file), 'w', encoding='utf-8') as f:
+            json.dump(sorted(set(sentences)), f)
+        record['sentences_file'] = sentences_file
+        record['last_used'] = time.time()
+        self._release_previous(record)
+
+    def load_sentences(self, path: str) -> Optional[List[str]]:
+        sentences_file = self.files[path].get('sentences_file')
+        if not sentences_file:
+            return None
+        try:
+            with open(os.path.join(self.sentences_dir, sentences_file), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cached sentences for {path} are unreadable: {e}")
+            self.files[path]['sentences_file'] = None
+            return None
+
+    def fingerprint(self) -> List[List[str]]:
+        """Identity of the mirrored folder content, compared with the last successful training."""
+        return sorted([path, record['content_hash'], record.get('sentences_file')] for path, record in self.files.items())
+
+    def enforce_quota(self) -> None:
+        """Evict least recently used local copies whose sentences are already cached."""
+        if self.quota_bytes is None:
+            return
+        local = [record for record in self.files.values() if record.get('local_path')]
+        total = sum(record.get('size', 0) for record in local)
+        for record in sorted(local, key=lambda r: r.get('last_used', 0)):
+            if total <= self.quota_bytes:
+                break
+            if record.get('sentences_file'):
+                self._remove_local(record)
+                total -= record.get('size', 0)
+        self.save_manifest()
+
+
+def no_progress(stage: str, done: Optional[int] = None, total: Optional[int] = None) -> None:
+    """progress(stage, done, total) callback for callers that do not report progress."""
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
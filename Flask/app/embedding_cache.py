@@ -0,0 +1,138 @@
+"""
+Persistent sentence-embedding cache: memory-mapped float16 rows keyed by sentence hash, one store per model
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .locks import file_lock
+
+logger = logging.getLogger(__name__)
+
+
+def sentence_hash(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Append-only on-disk embeddings of one model, shared by every process on the host.
+
+    vectors.f16 holds float16 rows and keys.txt the sentence hash of each row, one per
+    line, so a row's offset is its line number. Writers append the rows before their
+    keys under a file lock, so readers only ever map complete rows; each lookup picks
+    up keys appended by other processes since the last one.
+    """
+
+    def __init__(self, directory: str, model_id: str):
+        self.model_id = model_id
+        self.directory = os.path.join(directory, re.sub(r'[^A-Za-z0-9_.@-]+', '_', model_id))
+        os.makedirs(self.directory, exist_ok=True)
+        self.vectors_path = os.path.join(self.directory, 'vectors.f16')
+        self.keys_path = os.path.join(self.directory, 'keys.txt')
+        self.meta_path = os.path.join(self.directory, 'meta.json')
+        self.dim = None
+        self._rows: Dict[str, int] = {}
+        self._count = 0
+        self._keys_offset = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+        with self._lock:
+            self._refresh()
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        """Map rows whose keys were appended since the last refresh, by any process."""
+        try:
+            size = os.path.getsize(self.keys_path)
+        except FileNotFoundError:
+            return
+        if size == self._keys_offset:
+            return
+        if self.dim is None:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        with open(self.keys_path, 'rb') as f:
+            f.seek(self._keys_offset)
+            data = f.read(size - self._keys_offset)
+        # A line still being written is picked up next time
+        data = data[:data.rfind(b'\n') + 1]
+        for key in data.decode('ascii').splitlines():
+            self._rows.setdefault(key, self._count)
+            self._count += 1
+        self._keys_offset += len(data)
+        if self._count:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r', shape=(self._count, self.dim))
+
+    def get(self, hashes: List[str]) -> Tuple[List[int], np.ndarray]:
+        """(positions in hashes that are cached, their float32 unit-length rows)."""
+        with self._lock:
+            self._refresh()
+            # Row numbers and the mapping they index into, taken together
+            found = [i for i, key in enumerate(hashes) if key in self._rows]
+            rows = [self._rows[hashes[i]] for i in found]
+            vectors = self._vectors
+            self.hits += len(found)
+            self.misses += len(hashes) - len(found)
+        if not found:
+            return [], np.zeros((0, self.dim or 0), dtype=np.float32)
+        cached = np.asarray(vectors[rows], dtype=np.float32)
+        # Undo the float16 rounding of the norm so cosine scores stay comparable
+        norms = np.linalg.norm(cached, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return found, cached / norms
+
+    def put(self, hashes: List[str], vectors: np.ndarray) -> int:
+        """Append rows not cached yet; returns how many were written."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, file_lock(os.path.join(self.directory, 'write.lock')):
+            self._refresh()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump({'model': self.model_id, 'dim': self.dim, 'dtype': 'float16'}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Expected {self.dim}-dimensional embeddings for {self.model_id}, got {vectors.shape[1]}")
+            new = {}
+            for key, vector in zip(hashes, vectors):
+                if key not in self._rows and key not in new:
+                    new[key] = vector
+            if not new:
+                return 0
+            with open(self.vectors_path, 'ab') as f:
+                # Drop rows a crashed writer appended without their keys
+                f.truncate(self._count * self.dim * 2)
+                f.write(np.vstack(list(new.values())).astype(np.float16).tobytes())
+            with open(self.keys_path, 'a', encoding='ascii') as f:
+                f.write(''.join(f"{key}\n" for key in new))
+            self._refresh()
+            self.writes += len(new)
+            return len(new)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'model': self.model_id,
+            'rows': len(self._rows),
+            'bytes': self._count * (self.dim or 0) * 2,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'writes': self.writes
+        }
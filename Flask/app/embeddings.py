@@ -0,0 +1,271 @@
+"""
+SBERT encoding helpers shared by training and retrieval
+"""
+
+import os
+import threading
+import weakref
+from typing import Dict, List, Optional
+import numpy as np
+from .cache import LRUCache
+from .embedding_cache import EmbeddingCache, sentence_hash
+from .encode_batcher import EncodeBatcher
+from .inference import INFERENCE_CONCURRENCY, inference_gate
+
+# LRU cache in front of query encodes, keyed on (model name, cleaned text)
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '3600'))
+query_embedding_cache = LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL or None)
+
+# Request-time encodes of at most ENCODE_BATCH_MAX_SIZE texts are merged across threads for up
+# to ENCODE_BATCH_MAX_WAIT_MS; 0 encodes every call on its own
+ENCODE_BATCH_MAX_WAIT_MS = float(os.getenv('ENCODE_BATCH_MAX_WAIT_MS', '5'))
+ENCODE_BATCH_MAX_SIZE = int(os.getenv('ENCODE_BATCH_MAX_SIZE', '32'))
+
+# Longer inputs are truncated to this many word pieces (the model's own limit applies if lower)
+ENCODE_MAX_SEQ_LENGTH = int(os.getenv('ENCODE_MAX_SEQ_LENGTH', '256'))
+# Inputs are sorted by token length and cut into batches of at most this many padded tokens
+ENCODE_MAX_BATCH_TOKENS = int(os.getenv('ENCODE_MAX_BATCH_TOKENS', '8192'))
+
+# On-disk embeddings of previously encoded sentences, per model and max_seq_length; empty disables it
+ENCODE_CACHE_DIR = os.getenv('ENCODE_CACHE_DIR', os.path.expanduser('~/.cache/chatbot/embeddings'))
+
+_model_names = weakref.WeakKeyDictionary()
+# model -> its micro-batcher; models live as long as the process
+_batchers: Dict = {}
+_batchers_lock = threading.Lock()
+# model -> its disk cache (None when disabled or unusable)
+_disk_caches: Dict = {}
+
+
+def set_model_name(sbert_model, name: str) -> None:
+    """Record the name a loaded model was created from, used in cache keys."""
+    _model_names[sbert_model] = name
+
+
+def configure_model(sbert_model, max_seq_length: int = ENCODE_MAX_SEQ_LENGTH) -> None:
+    """Truncate inputs to max_seq_length tokens, never raising the model's own limit."""
+    current = getattr(sbert_model, 'max_seq_length', None)
+    sbert_model.max_seq_length = min(current, max_seq_length) if current else max_seq_length
+
+
+def model_name(sbert_model) -> str:
+    try:
+        return _model_names[sbert_model]
+    except (KeyError, TypeError):
+        return type(sbert_model).__name__
+
+
+def encode_batcher(sbert_model) -> EncodeBatcher:
+    """The micro-batcher shared by every request thread using this model."""
+    with _batchers_lock:
+        if sbert_model not in _batchers:
+            _batchers[sbert_model] = EncodeBatcher(
+                lambda texts: _encode_batches(sbert_model, texts, ENCODE_BATCH_MAX_SIZE),
+                max_wait=ENCODE_BATCH_MAX_WAIT_MS / 1000, max_batch=ENCODE_BATCH_MAX_SIZE,
+                workers=INFERENCE_CONCURRENCY
+            )
+        return _batchers[sbert_model]
+
+
+def encode_batcher_stats() -> Dict:
+    with _batchers_lock:
+        batchers = list(_batchers.items())
+    return {model_name(sbert_model): batcher.stats() for sbert_model, batcher in batchers}
+
+
+def embedding_cache(sbert_model) -> Optional[EmbeddingCache]:
+    """The disk cache of this model; truncation changes embeddings, so max_seq_length is part of the key."""
+    with _batchers_lock:
+        if sbert_model not in _disk_caches:
+            cache = None
+            # Only models registered with set_model_name, so two models never share a cache
+            if ENCODE_CACHE_DIR and sbert_model in _model_names:
+                model_id = f"{model_name(sbert_model)}@{getattr(sbert_model, 'max_seq_length', None)}"
+                try:
+                    cache = EmbeddingCache(ENCODE_CACHE_DIR, model_id)
+                except (OSError, ValueError) as e:
+                    print(f"Embedding cache in {ENCODE_CACHE_DIR} is unusable, encoding without it: {e}")
+            _disk_caches[sbert_model] = cache
+        return _disk_caches[sbert_model]
+
+
+def embedding_cache_stats() -> Dict:
+    with _batchers_lock:
+        caches = list(_disk_caches.items())
+    return {model_name(sbert_model): cache.stats() for sbert_model, cache in caches if cache is not None}
+
+
+def encode_sentences(sbert_model, sentences: List[str], batch_size: int = 64, store: bool = False) -> np.ndarray:
+    """Encode sentences in batches and return L2-normalized float32 embeddings.
+
+    Every encode in the app goes through here. Sentences in the disk cache are not
+    encoded again; store=True adds the newly encoded ones (training does, so request
+    text never grows the cache). Small calls (queries, per-request sentence sets) are
+    merged with those of concurrent requests; larger ones, like training, are split into
+    batches that each hold an inference slot only while they run.
+    """
+    sentences = list(sentences)
+    cache = embedding_cache(sbert_model) if sentences else None
+    if cache is None:
+        return _encode_uncached(sbert_model, sentences, batch_size)
+    hashes = [sentence_hash(s) for s in sentences]
+    try:
+        found, cached = cache.get(hashes)
+    except (OSError, ValueError) as e:
+        print(f"Error reading the embedding cache, encoding without it: {e}")
+        return _encode_uncached(sbert_model, sentences, batch_size)
+    if len(found) == len(sentences):
+        return cached
+    cached_rows = set(found)
+    missing = [i for i in range(len(sentences)) if i not in cached_rows]
+    encoded = _encode_uncached(sbert_model, [sentences[i] for i in missing], batch_size)
+    if store:
+        try:
+            cache.put([hashes[i] for i in missing], encoded)
+        except (OSError, ValueError) as e:
+            print(f"Error writing the embedding cache: {e}")
+    if not found:
+        return encoded
+    result = np.empty((len(sentences), encoded.shape[1]), dtype=np.float32)
+    result[found] = cached
+    result[missing] = encoded
+    return result
+
+
+def _encode_uncached(sbert_model, sentences: List[str], batch_size: int) -> np.ndarray:
+    if ENCODE_BATCH_MAX_WAIT_MS > 0 and 0 < len(sentences) <= ENCODE_BATCH_MAX_SIZE:
+        return encode_batcher(sbert_model).encode(sentences)
+    return _encode_batches(sbert_model, sentences, batch_size)
+
+
+def token_lengths(sbert_model, sentences: List[str]) -> np.ndarray:
+    """Word pieces per sentence, special tokens included and capped at the model's max_seq_length."""
+    max_length = getattr(sbert_model, 'max_seq_length', None) or ENCODE_MAX_SEQ_LENGTH
+    tokenizer = getattr(sbert_model, 'tokenizer', None)
+    if tokenizer is not None:
+        try:
+            ids = tokenizer(sentences, add_special_tokens=True, truncation=True, max_length=max_length)['input_ids']
+            return np.array([len(row) for row in ids], dtype=np.int64)
+        except Exception:
+            pass
+    # No usable tokenizer: about four word pieces per three words, plus [CLS] and [SEP]
+    return np.minimum(np.array([len(s.split()) * 4 // 3 + 2 for s in sentences], dtype=np.int64), max_length)
+
+
+def length_buckets(sorted_lengths: np.ndarray, batch_size: int,
+                   max_batch_tokens: int = ENCODE_MAX_BATCH_TOKENS) -> List[slice]:
+    """Split ascending token lengths into batches of at most batch_size inputs and max_batch_tokens padded tokens.
+
+    A batch is padded to its longest input, so short inputs fill whole batches while long
+    ones share smaller batches instead of inflating the padding of short ones.
+    """
+    buckets = []
+    start = 0
+    for end in range(1, len(sorted_lengths) + 1):
+        size = end - start
+        if size > batch_size or (size > 1 and size * int(sorted_lengths[end - 1]) > max_batch_tokens):
+            buckets.append(slice(start, end - 1))
+            start = end - 1
+    if start < len(sorted_lengths):
+        buckets.append(slice(start, len(sorted_lengths)))
+    return buckets
+
+
+class _PaddingStats:
+    """Real vs padded tokens of every encode batch, to show how much compute padding wastes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.tokens = 0
+        self.padded_tokens = 0
+        self.at_max_length = 0
+
+    def record(self, lengths: np.ndarray, at_max_length: int) -> None:
+        with self._lock:
+            self.batches += 1
+            self.tokens += int(lengths.sum())
+            self.padded_tokens += int(lengths.max()) * len(lengths)
+            self.at_max_length += at_max_length
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'max_seq_length': ENCODE_MAX_SEQ_LENGTH,
+                'max_batch_tokens': ENCODE_MAX_BATCH_TOKENS,
+                'batches': self.batches,
+                'tokens': self.tokens,
+                'padding_efficiency': round(self.tokens / self.padded_tokens, 3) if self.padded_tokens else None,
+                # Inputs reaching max_seq_length, i.e. (almost always) truncated
+                'inputs_at_max_length': self.at_max_length
+            }
+
+
+padding_stats = _PaddingStats()
+
+
+def _encode_batches(sbert_model, sentences: List[str], batch_size: int,
+                    lengths: Optional[np.ndarray] = None) -> np.ndarray:
+    """Encode in length-sorted buckets, each holding an inference slot, and return rows in input order."""
+    if not sentences:
+        with inference_gate.slot('encode'):
+            return np.asarray(sbert_model.encode([], convert_to_numpy=True, normalize_embeddings=True,
+                                                 show_progress_bar=False), dtype=np.float32)
+    if lengths is None:
+        lengths = token_lengths(sbert_model, sentences)
+    max_length = getattr(sbert_model, 'max_seq_length', None) or ENCODE_MAX_SEQ_LENGTH
+    order = np.argsort(lengths, kind='stable')
+    result = None
+    for bucket in length_buckets(lengths[order], batch_size):
+        rows = order[bucket]
+        with inference_gate.slot('encode'):
+            embeddings = sbert_model.encode(
+                [sentences[i] for i in rows],
+                batch_size=len(rows),
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if result is None:
+            result = np.empty((len(sentences), embeddings.shape[1]), dtype=np.float32)
+        result[rows] = embeddings
+        padding_stats.record(lengths[rows], int((lengths[rows] >= max_length).sum()))
+    return result
+
+
+def encode_query(sbert_model, text: str) -> np.ndarray:
+    """Encode a single query into a normalized embedding vector, served from the LRU cache when possible."""
+    from .utils import clean_text  # utils imports this module at load time
+
+    cleaned = clean_text(text)
+
+    def compute() -> np.ndarray:
+        vector = encode_sentences(sbert_model, [cleaned])[0]
+        vector.flags.writeable = False  # shared between requests
+        return vector
+
+    return query_embedding_cache.get_or_compute((model_name(sbert_model), cleaned), compute)
+
+
+class EmbeddingMemo:
+    """Per-request memo: every distinct text is encoded at most once, in a single batch per call."""
+
+    def __init__(self, sbert_model):
+        self.sbert_model = sbert_model
+        self._vectors: Dict[str, np.ndarray] = {}
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        missing = [text for text in dict.fromkeys(texts) if text not in self._vectors]
+        if missing:
+            for text, vector in zip(missing, encode_sentences(self.sbert_model, missing)):
+                self._vectors[text] = vector
+        return np.vstack([self._vectors[text] for text in texts])
+
+    def similarities(self, query: str, sentences: List[str]) -> np.ndarray:
+        """Cosine similarity of the query to each sentence, reusing memoized vectors."""
+        if not sentences:
+            return np.zeros(0, dtype=np.float32)
+        vectors = self.encode([query] + list(sentences))
+        return vectors[1:] @ vectors[0]
@@ -0,0 +1,154 @@
+"""
+Cross-request micro-batching of small SBERT encodes
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class _Request:
+    __slots__ = ('texts', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, texts: List[str], enqueued_at: float):
+        self.texts = texts
+        self.enqueued_at = enqueued_at
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+
+
+class EncodeBatcher:
+    """Collects encodes from concurrent requests and runs them as one batch.
+
+    A worker takes the oldest waiting request, keeps collecting for up to max_wait
+    seconds or until max_batch texts are queued, then encodes every distinct text once
+    and hands each caller its own rows. Requests larger than max_batch run on their own.
+    Worker threads start on first use, and again in a forked gunicorn worker.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], max_wait: float = 0.005,
+                 max_batch: int = 32, workers: int = 1, window: int = 1000, clock=time.perf_counter):
+        self.encode_fn = encode_fn
+        self.max_wait = max_wait
+        self.max_batch = max(1, max_batch)
+        self.workers = max(1, workers)
+        self.clock = clock
+        self._window = window
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # A forked child gets the queue and locks but none of the threads
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self) -> None:
+        self._started = False
+        self._condition = threading.Condition()
+        self._pending: deque = deque()
+        self._queued_texts = 0
+        # Recent batch sizes (distinct texts) and queue waits, for percentiles
+        self._batch_sizes = deque(maxlen=self._window)
+        self._queue_waits = deque(maxlen=self._window)
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.duplicates = 0
+
+    def _ensure_started(self) -> None:
+        if self._started:
+            return
+        with self._condition:
+            if self._started:
+                return
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"encode-batcher-{i}", daemon=True).start()
+            self._started = True
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Rows of normalized embeddings for texts, encoded together with other waiting requests."""
+        self._ensure_started()
+        request = _Request(list(texts), self.clock())
+        with self._condition:
+            self._pending.append(request)
+            self._queued_texts += len(request.texts)
+            self._condition.notify_all()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = self._pending[0].enqueued_at + self.max_wait
+                while self._pending and self._queued_texts < self.max_batch:
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._take()
+            if batch:
+                self._run(batch)
+
+    def _take(self) -> List[_Request]:
+        batch = []
+        size = 0
+        while self._pending and (not batch or size + len(self._pending[0].texts) <= self.max_batch):
+            request = self._pending.popleft()
+            batch.append(request)
+            size += len(request.texts)
+        self._queued_texts -= size
+        return batch
+
+    def _run(self, batch: List[_Request]) -> None:
+        started = self.clock()
+        texts = list(dict.fromkeys(text for request in batch for text in request.texts))
+        total = sum(len(request.texts) for request in batch)
+        try:
+            vectors = np.asarray(self.encode_fn(texts), dtype=np.float32)
+            rows = {text: i for i, text in enumerate(texts)}
+            for request in batch:
+                request.result = vectors[[rows[text] for text in request.texts]]
+        except BaseException as e:
+            logger.warning(f"Batched encode of {len(texts)} texts failed: {e}")
+            for request in batch:
+                request.error = e
+        finally:
+            with self._condition:
+                self.requests += len(batch)
+                self.batches += 1
+                self.texts += len(texts)
+                self.duplicates += total - len(texts)
+                self._batch_sizes.append(len(texts))
+                self._queue_waits.extend(started - request.enqueued_at for request in batch)
+            for request in batch:
+                request.done.set()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            sizes = np.array(self._batch_sizes) if self._batch_sizes else None
+            waits = np.array(self._queue_waits) if self._queue_waits else None
+            return {
+                'max_wait_ms': round(1000 * self.max_wait, 3),
+                'max_batch': self.max_batch,
+                'workers': self.workers,
+                'queued_requests': len(self._pending),
+                'requests': self.requests,
+                'batches': self.batches,
+                'texts_encoded': self.texts,
+                'duplicate_texts': self.duplicates,
+                'mean_requests_per_batch': round(self.requests / self.batches, 2) if self.batches else None,
+                'mean_batch_size': round(float(sizes.mean()), 2) if sizes is not None else None,
+                'p95_batch_size': float(np.percentile(sizes, 95)) if sizes is not None else None,
+                'max_batch_size': int(sizes.max()) if sizes is not None else None,
+                'p50_queue_ms': round(1000 * float(np.percentile(waits, 50)), 3) if waits is not None else None,
+                'p95_queue_ms': round(1000 * float(np.percentile(waits, 95)), 3) if waits is not None else None
+            }
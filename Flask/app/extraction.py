@@ -0,0 +1,275 @@
+"""
+Text extraction and sentence segmentation for training files, fanned out to a process pool
+"""
+
+import logging
+import multiprocessing
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+import pdfplumber
+import openpyxl
+from docx import Document
+import spacy
+
+logger = logging.getLogger(__name__)
+
+# Table headers and section titles that are not conditions
+HEADER_PATTERN = re.compile(
+    r'^(Summary|Condition Type|Details|Explanation|Requirements?|Procedures?|Restrictions?|Timeframes?|Fees|Section|Contact)\b',
+    re.IGNORECASE
+)
+
+
+# Cheapest formats to extract first; PDF layout analysis is by far the slowest
+DEFAULT_FORMAT_PREFERENCE = ['txt', 'docx', 'xlsx', 'xls', 'pdf', 'doc']
+
+
+class ExtractionResult(NamedTuple):
+    file_path: str
+    sentences: Optional[List[str]]
+    error: Optional[str]
+    seconds: float
+
+
+def extract_text_from_pdf(file_path: str) -> str:
+    text = ""
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            if page_text:
+                page_text = re.sub(r'\s+', ' ', page_text).strip()
+                text += page_text + "\n\n"
+    return text
+
+def extract_text_from_excel(file_path: str) -> str:
+    text = ""
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    for sheet in workbook:
+        for row in sheet.rows:
+            row_text = " ".join(str(cell.value) for cell in row if cell.value)
+            if row_text:
+                text += row_text + "\n"
+    return re.sub(r'\s+', ' ', text).strip()
+
+def extract_text_from_word(file_path: str) -> str:
+    doc = Document(file_path)
+    text = ""
+    for para in doc.paragraphs:
+        if para.text:
+            text += para.text + "\n"
+    return re.sub(r'\s+', ' ', text).strip()
+
+def extract_text(file_path: str) -> str:
+    extension = file_path.rsplit('.', 1)[1].lower()
+    try:
+        if extension == 'pdf':
+            return extract_text_from_pdf(file_path)
+        elif extension in ['xlsx', 'xls']:
+            return extract_text_from_excel(file_path)
+        elif extension == 'docx':
+            return extract_text_from_word(file_path)
+        elif extension == 'txt':
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return re.sub(r'\s+', ' ', f.read()).strip()
+        else:
+            return ""
+    except Exception as e:
+        logger.error(f"Error extracting text from {file_path}: {e}")
+        return ""
+
+def filter_sentences(sentences: Iterable[str]) -> List[str]:
+    """Drop empty lines, header-like lines and very short lines from segmented text."""
+    kept = []
+    for s in sentences:
+        s = s.strip()
+        if not s:
+            continue
+        if HEADER_PATTERN.match(s):
+            continue
+        if len(s.split()) < 4:  # Skip very short lines
+            continue
+        kept.append(s)
+    return kept
+
+
+def load_segmenter(mode: str = 'sentencizer', model_name: str = 'en_core_web_md'):
+    """Trimmed pipeline for training-time sentence splitting.
+
+    'sentencizer' is a blank tokenizer plus punctuation rules; 'senter' loads the trained
+    pipeline with only its statistical sentence recognizer enabled. Neither runs the
+    tagger, parser, lemmatizer or NER.
+    """
+    if mode == 'senter':
+        nlp = spacy.load(model_name, exclude=['tagger', 'parser', 'attribute_ruler', 'lemmatizer', 'ner'])
+        nlp.enable_pipe('senter')
+    else:
+        nlp = spacy.blank('en')
+        nlp.add_pipe('sentencizer')
+    nlp.max_length = 10_000_000
+    return nlp
+
+
+def segmenter_name(mode: str = 'sentencizer', model_name: str = 'en_core_web_md') -> str:
+    """Identity of the segmentation setup load_segmenter builds, stored with the sentences it produced."""
+    return f"senter-{model_name}" if mode == 'senter' else 'sentencizer'
+
+
+def segment_texts(texts: List[str], nlp, batch_size: int = 32, n_process: int = 1) -> List[List[str]]:
+    """Split many documents into filtered sentences with one batched nlp.pipe call."""
+    return [
+        filter_sentences(sent.text for sent in doc.sents)
+        for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+    ]
+
+
+_segmenter = None
+_segmenter_mode = None
+
+
+def _init_worker(mode: str = 'sentencizer') -> None:
+    global _segmenter, _segmenter_mode
+    if _segmenter is None or _segmenter_mode != mode:
+        _segmenter = load_segmenter(mode)
+        _segmenter_mode = mode
+
+
+def extract_chunk(file_paths: List[str], mode: str = 'sentencizer', batch_size: int = 32,
+                  n_process: int = 1) -> List[ExtractionResult]:
+    """Extract a group of files, then segment all their texts in one batched pass; failures are returned, never raised."""
+    _init_worker(mode)
+    texts = {}
+    results = {}
+    for file_path in file_paths:
+        start = time.monotonic()
+        try:
+            text = extract_text(file_path)
+        except Exception as e:
+            text, error = None, str(e)
+        else:
+            error = None if text else 'no text extracted'
+        elapsed = time.monotonic() - start
+        if error:
+            results[file_path] = ExtractionResult(file_path, None, error, elapsed)
+        else:
+            texts[file_path] = (text, elapsed)
+
+    paths = list(texts)
+    try:
+        segmented = segment_texts([texts[p][0] for p in paths], _segmenter, batch_size, n_process)
+    except Exception:
+        # Isolate the document that broke the batch
+        segmented = []
+        for p in paths:
+            try:
+                segmented.append(segment_texts([texts[p][0]], _segmenter)[0])
+            except Exception as e:
+                segmented.append(e)
+    for p, sentences in zip(paths, segmented):
+        if isinstance(sentences, Exception):
+            results[p] = ExtractionResult(p, None, str(sentences), texts[p][1])
+        else:
+            results[p] = ExtractionResult(p, sentences, None, texts[p][1])
+    return [results[file_path] for file_path in file_paths]
+
+
+def _pool_context():
+    # Training runs on a background thread of a process with torch, pymongo and request
+    # threads, which forking could leave holding locks. forkserver children start from a
+    # clean server process (spawn where it is missing); re-importing the __main__ script
+    # there is cheap since models and clients load lazily, and __main__ guards the rest.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def extract_files(file_paths: List[str], workers: int = 1, mode: str = 'sentencizer',
+                  batch_size: int = 32, n_process: int = 1,
+                  progress: Optional[Callable[[int, int], None]] = None) -> Dict[str, ExtractionResult]:
+    """Extract every file, in a pool of worker processes when workers > 1; results are keyed and ordered by path.
+
+    Each worker receives a chunk of files and segments them with nlp.pipe. In-process
+    extraction can instead spread segmentation over spaCy's own n_process workers.
+    progress(done, total) is called as chunks complete.
+    """
+    file_paths = sorted(set(file_paths))
+    results = {}
+    if progress is not None:
+        progress(0, len(file_paths))
+    if workers > 1 and len(file_paths) > 1:
+        workers = min(workers, len(file_paths))
+        # A few chunks per worker keeps the pool balanced when PDFs are slower than text files
+        chunks = [file_paths[i::workers * 2] for i in range(workers * 2) if file_paths[i::workers * 2]]
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context(),
+                                     initializer=_init_worker, initargs=(mode,)) as pool:
+                futures = [(chunk, pool.submit(extract_chunk, chunk, mode, batch_size)) for chunk in chunks]
+                for chunk, future in futures:
+                    try:
+                        for result in future.result():
+                            results[result.file_path] = result
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        for file_path in chunk:
+                            results[file_path] = ExtractionResult(file_path, None, f"worker failed: {e}", 0.0)
+                    if progress is not None:
+                        progress(len(results), len(file_paths))
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed by the OS): finish the remaining files in-process
+            logger.warning(f"Extraction pool failed, continuing in-process: {e}")
+    remaining = [file_path for file_path in file_paths if file_path not in results]
+    if remaining:
+        for result in extract_chunk(remaining, mode, batch_size, n_process):
+            results[result.file_path] = result
+        if progress is not None:
+            progress(len(results), len(file_paths))
+    return {file_path: results[file_path] for file_path in file_paths}
+
+
+def logical_document_key(file_name: str) -> str:
+    """Stem and version shared by every format of one document, e.g. 'exchanges_v3'."""
+    return os.path.splitext(os.path.basename(file_name))[0].lower()
+
+
+def _format_rank(file_name: str, preference: List[str]) -> int:
+    extension = file_name.rsplit('.', 1)[-1].lower()
+    return preference.index(extension) if extension in preference else len(preference)
+
+
+def select_document_formats(file_names: Iterable[str], preference: List[str] = None,
+                            verify_sample_rate: float = 0.0) -> Dict[str, str]:
+    """Choose which files of each logical document to extract.
+
+    Returns {file name: 'primary'} for the cheapest format of every document, plus
+    {file name: 'verify'} for one other format of a stable sample of documents.
+    """
+    preference = preference or DEFAULT_FORMAT_PREFERENCE
+    groups = {}
+    for name in file_names:
+        groups.setdefault(logical_document_key(name), []).append(name)
+    selection = {}
+    for key, names in groups.items():
+        ordered = sorted(names, key=lambda n: (_format_rank(n, preference), n))
+        selection[ordered[0]] = 'primary'
+        if len(ordered) > 1 and verify_sample_rate > 0:
+            # Stable sample, so verification files stay cached in the mirror between runs
+            checksum = zlib.crc32(key.encode('utf-8'))
+            if (checksum % 10000) / 10000 < verify_sample_rate:
+                selection[ordered[1 + checksum % (len(ordered) - 1)]] = 'verify'
+    return selection
+
+
+def format_agreement(sentences: List[str], other_sentences: List[str]) -> float:
+    """Jaccard similarity of the word sets of two extractions of the same document."""
+    words = set(re.findall(r'\w+', ' '.join(sentences).lower()))
+    other_words = set(re.findall(r'\w+', ' '.join(other_sentences).lower()))
+    union = words | other_words
+    return len(words & other_words) / len(union) if union else 1.0
+
+
+def default_workers() -> int:
+    return max(1, min(4, os.cpu_count() or 1))
@@ -0,0 +1,105 @@
+"""
+CPU budget for model inference: torch thread counts and a gate on concurrent encodes
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Cores this process may use for inference; gunicorn.conf.py sets it to the per-worker share
+INFERENCE_CPU_BUDGET = int(os.getenv('TORCH_THREADS_PER_WORKER', str(os.cpu_count() or 1)))
+# Threads one encode uses; concurrent encodes x intra-op threads stays within the budget
+TORCH_INTRA_OP_THREADS = int(os.getenv('TORCH_INTRA_OP_THREADS', str(max(1, min(4, INFERENCE_CPU_BUDGET)))))
+TORCH_INTER_OP_THREADS = int(os.getenv('TORCH_INTER_OP_THREADS', '1'))
+INFERENCE_CONCURRENCY = int(os.getenv(
+    'INFERENCE_CONCURRENCY', str(max(1, INFERENCE_CPU_BUDGET // TORCH_INTRA_OP_THREADS))
+))
+# Waits longer than this are logged
+INFERENCE_SLOW_WAIT = float(os.getenv('INFERENCE_SLOW_WAIT', '0.5'))
+
+
+def configure_threads(intra_op: int = TORCH_INTRA_OP_THREADS, inter_op: int = TORCH_INTER_OP_THREADS) -> Dict:
+    """Apply the torch thread limits; call after torch is imported and again in each forked worker."""
+    try:
+        import torch
+    except ImportError:
+        return {}
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        # Only settable before the first parallel op; keeps its earlier value
+        pass
+    return {'intra_op': torch.get_num_threads(), 'inter_op': torch.get_num_interop_threads()}
+
+
+class InferenceGate:
+    """Semaphore admitting at most `concurrency` encodes at once, recording how long callers queue."""
+
+    def __init__(self, concurrency: int, window: int = 1000, slow_wait: float = INFERENCE_SLOW_WAIT,
+                 clock=time.perf_counter):
+        self.concurrency = max(1, concurrency)
+        self.slow_wait = slow_wait
+        self.clock = clock
+        self._semaphore = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        # Recent queue waits, for percentiles
+        self._waits = deque(maxlen=window)
+        self._counts: Dict[str, int] = {}
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waiting = 0
+        self.in_flight = 0
+
+    @contextmanager
+    def slot(self, kind: str = 'encode'):
+        start = self.clock()
+        with self._lock:
+            self.waiting += 1
+        self._semaphore.acquire()
+        waited = self.clock() - start
+        with self._lock:
+            self.waiting -= 1
+            self.in_flight += 1
+            self.acquired += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self._waits.append(waited)
+            self._counts[kind] = self._counts.get(kind, 0) + 1
+        if waited > self.slow_wait:
+            logger.warning(f"{kind} waited {waited:.2f}s for an inference slot ({self.concurrency} slots)")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            waits = np.array(self._waits) if self._waits else None
+            return {
+                'concurrency': self.concurrency,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'acquired': self.acquired,
+                'by_kind': dict(self._counts),
+                'mean_wait_ms': round(1000 * self.total_wait / self.acquired, 3) if self.acquired else None,
+                'p50_wait_ms': round(1000 * float(np.percentile(waits, 50)), 3) if waits is not None else None,
+                'p95_wait_ms': round(1000 * float(np.percentile(waits, 95)), 3) if waits is not None else None,
+                'max_wait_ms': round(1000 * self.max_wait, 3),
+                'torch_intra_op_threads': TORCH_INTRA_OP_THREADS,
+                'torch_inter_op_threads': TORCH_INTER_OP_THREADS
+            }
+
+
+inference_gate = InferenceGate(INFERENCE_CONCURRENCY)
@@ -0,0 +1,168 @@
+"""
+Dropbox client stand-in that serves a local directory, for running training without credentials
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+import dropbox
+import requests
+
+DROPBOX_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def dropbox_content_hash(file_path: str) -> str:
+    """Dropbox content_hash: SHA-256 over the concatenated SHA-256 digests of 4 MB blocks."""
+    block_digests = b''
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(DROPBOX_HASH_BLOCK_SIZE)
+            if not block:
+                break
+            block_digests += hashlib.sha256(block).digest()
+    return hashlib.sha256(block_digests).hexdigest()
+
+
+class LocalResponse:
+    """Minimal streaming response with the parts of requests.Response the downloader uses."""
+
+    def __init__(self, file_path: str):
+        self._file = open(file_path, 'rb')
+
+    def iter_content(self, chunk_size: int = 1024 * 1024):
+        while True:
+            chunk = self._file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    @property
+    def content(self) -> bytes:
+        return b''.join(self.iter_content())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class LocalDropboxClient:
+    """Serves the Dropbox listing, change-cursor and download calls from a local folder mapped to Dropbox paths.
+
+    A cursor records the rev of every file it has seen, so files_list_folder_continue
+    returns what changed since (new or modified files, and DeletedMetadata for removals).
+    """
+
+    def __init__(self, root: str, folder_path: str = '/chatbot-training', page_size: int = 100,
+                 transient_failures: int = 0, poll_interval: float = 0.5):
+        self.root = root
+        self.folder_path = folder_path.rstrip('/').lower()
+        self.page_size = page_size
+        # Number of upcoming downloads that fail with a connection error, to exercise retries
+        self.transient_failures = transient_failures
+        # How often files_list_folder_longpoll re-scans the folder
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+
+    def _local_path(self, path: str) -> str:
+        path = path.lower()
+        if path != self.folder_path and not path.startswith(self.folder_path + '/'):
+            raise dropbox.exceptions.ApiError('local', f"path not found: {path}", None, None)
+        relative = path[len(self.folder_path):].lstrip('/')
+        if not relative:
+            return self.root
+        for name in os.listdir(self.root):
+            if name.lower() == relative:
+                return os.path.join(self.root, name)
+        raise dropbox.exceptions.ApiError('local', f"path not found: {path}", None, None)
+
+    def _metadata(self, name: str) -> dropbox.files.FileMetadata:
+        file_path = os.path.join(self.root, name)
+        stat = os.stat(file_path)
+        modified = datetime.datetime.utcfromtimestamp(int(stat.st_mtime))
+        return dropbox.files.FileMetadata(
+            name=name,
+            id=f"id:{name}",
+            client_modified=modified,
+            server_modified=modified,
+            rev=_rev(stat),
+            size=stat.st_size,
+            path_lower=f"{self.folder_path}/{name.lower()}",
+            path_display=f"{self.folder_path}/{name}",
+            content_hash=dropbox_content_hash(file_path)
+        )
+
+    def _deleted_metadata(self, name: str) -> dropbox.files.DeletedMetadata:
+        return dropbox.files.DeletedMetadata(
+            name=name,
+            path_lower=f"{self.folder_path}/{name.lower()}",
+            path_display=f"{self.folder_path}/{name}"
+        )
+
+    def _state(self) -> Dict[str, str]:
+        """Current rev of every file, cheap enough to take on each poll."""
+        state = {}
+        for name in os.listdir(self.root):
+            file_path = os.path.join(self.root, name)
+            if os.path.isfile(file_path) and not name.endswith('.part'):
+                state[name] = _rev(os.stat(file_path))
+        return state
+
+    @staticmethod
+    def _changed_names(seen: Dict[str, str], state: Dict[str, str]) -> List[str]:
+        return sorted(name for name in set(seen) | set(state) if seen.get(name) != state.get(name))
+
+    def list_entries(self) -> List[dropbox.files.FileMetadata]:
+        return [self._metadata(name) for name in sorted(self._state())]
+
+    def _page(self, seen: Dict[str, str], offset: int) -> dropbox.files.ListFolderResult:
+        state = self._state()
+        changed = self._changed_names(seen, state)
+        page = changed[offset:offset + self.page_size]
+        has_more = offset + self.page_size < len(changed)
+        entries = [self._metadata(name) if name in state else self._deleted_metadata(name) for name in page]
+        # The last page hands out a cursor positioned after everything listed so far
+        cursor = _cursor(seen, offset + len(page)) if has_more else _cursor(state, 0)
+        return dropbox.files.ListFolderResult(entries=entries, cursor=cursor, has_more=has_more)
+
+    def files_list_folder(self, path: str, recursive: bool = False) -> dropbox.files.ListFolderResult:
+        self._local_path(path)
+        return self._page({}, 0)
+
+    def files_list_folder_continue(self, cursor: str) -> dropbox.files.ListFolderResult:
+        data = json.loads(cursor)
+        return self._page(data['seen'], data['offset'])
+
+    def files_list_folder_get_latest_cursor(self, path: str, recursive: bool = False):
+        self._local_path(path)
+        return dropbox.files.ListFolderGetLatestCursorResult(cursor=_cursor(self._state(), 0))
+
+    def files_list_folder_longpoll(self, cursor: str, timeout: int = 30) -> dropbox.files.ListFolderLongpollResult:
+        """Block until the folder differs from the cursor or timeout seconds pass."""
+        seen = json.loads(cursor)['seen']
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._changed_names(seen, self._state()):
+                return dropbox.files.ListFolderLongpollResult(changes=True)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return dropbox.files.ListFolderLongpollResult(changes=False)
+            time.sleep(min(self.poll_interval, remaining))
+
+    def files_download(self, path: str):
+        with self._lock:
+            if self.transient_failures > 0:
+                self.transient_failures -= 1
+                raise requests.exceptions.ConnectionError(f"simulated transient failure for {path}")
+        local_path = self._local_path(path)
+        return self._metadata(os.path.basename(local_path)), LocalResponse(local_path)
+
+
+def _rev(stat: os.stat_result) -> str:
+    return f"{stat.st_mtime_ns:015x}{stat.st_size:x}"
+
+
+def _cursor(seen: Dict[str, str], offset: int) -> str:
+    return json.dumps({'seen': seen, 'offset': offset})
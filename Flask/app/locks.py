@@ -0,0 +1,37 @@
+"""
+Exclusive file locks shared by the worker processes of one host
+"""
+
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process, so every lock is granted at once
+    fcntl = None
+
+
+def flock_exclusive(lock_file: IO, blocking: bool = True) -> bool:
+    """Take an exclusive flock on an open file; without blocking, False while another process holds it."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    """Hold an exclusive flock on path for the with block, yielding whether it was taken.
+
+    With blocking=False the block runs straight away and gets False if the lock was busy.
+    """
+    with open(path, 'a') as lock_file:
+        acquired = flock_exclusive(lock_file, blocking)
+        try:
+            yield acquired
+        finally:
+            if acquired and fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
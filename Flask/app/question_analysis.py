@@ -0,0 +1,77 @@
+"""
+One spaCy parse of a user question, shared by everything that handles a /chat request
+"""
+
+import re
+from typing import Dict, List
+import numpy as np
+from .utils import key_phrases_from_doc, extract_question_intent
+from .embeddings import encode_query
+from .retrieval import normalize_rows
+
+QUESTION_WORDS = ['what', 'how', 'when', 'where', 'why', 'which', 'who']
+
+
+class QuestionAnalysis:
+    """Parsed question exposing the doc, lemmas, key phrases, focus words and intent."""
+
+    def __init__(self, question: str, nlp_model):
+        self.question = question
+        self.question_lower = question.lower()
+        self.doc = nlp_model(question)
+        self.lemmas = [token.lemma_.lower() for token in self.doc if not token.is_punct]
+        self.key_phrases = key_phrases_from_doc(self.doc)
+        self.focus_words = self._extract_focus_words()
+        self.intent = extract_question_intent(question)
+        self._embedding = None
+
+    def query_embedding(self, sbert_model) -> np.ndarray:
+        """Normalized SBERT embedding of the question, encoded at most once per request."""
+        if self._embedding is None:
+            self._embedding = encode_query(sbert_model, self.question)
+        return self._embedding
+
+    def _extract_focus_words(self) -> List[str]:
+        focus_words = []
+        for token in self.doc:
+            if token.pos_ in ['NOUN', 'VERB', 'ADJ'] and not token.is_stop and not token.is_punct and len(token.text) > 2:
+                focus_words.append(token.lemma_.lower())
+        for word in QUESTION_WORDS:
+            if word in self.question_lower:
+                focus_words.append(word)
+        focus_words.extend(self.key_phrases)
+        return list(set(focus_words))
+
+
+class TransactionTypeLabels:
+    """Label vectors and keyword patterns for every transaction type, built once at startup."""
+
+    def __init__(self, keywords: Dict[str, List[str]], nlp_model):
+        self.types = list(keywords)
+        self.label_vectors = normalize_rows(
+            np.vstack([nlp_model(t_type).vector for t_type in self.types]).astype(np.float32)
+        )
+        self.keyword_patterns = {
+            t_type: re.compile('|'.join(re.escape(keyword) for keyword in type_keywords))
+            for t_type, type_keywords in keywords.items()
+        }
+
+    def semantic_scores(self, doc) -> Dict[str, float]:
+        """Cosine similarity of the doc vector to every label vector (same as doc.similarity)."""
+        if not doc.has_vector or not doc.vector_norm:
+            return {t_type: 0.0 for t_type in self.types}
+        scores = self.label_vectors @ (doc.vector / doc.vector_norm)
+        return {t_type: float(score) for t_type, score in zip(self.types, scores)}
+
+    def phrase_scores(self, key_phrases: List[str]) -> Dict[str, float]:
+        """Share of key phrases containing at least one keyword of each type."""
+        scores = {}
+        for t_type, pattern in self.keyword_patterns.items():
+            matches = sum(1 for phrase in key_phrases if pattern.search(phrase))
+            scores[t_type] = matches / len(key_phrases) if key_phrases else 0
+        return scores
+
+
+def analyze_question(question: str, nlp_model) -> QuestionAnalysis:
+    """Factory function to parse a question once for the whole request"""
+    return QuestionAnalysis(question, nlp_model)
@@ -0,0 +1,120 @@
+"""
+Lazily initialized, thread-safe heavy resources (models, clients) with load timings
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Startup steps timed with timed(), in the order they ran: imports, model loads, warm-up
+_startup_steps: List[Dict] = []
+_steps_lock = threading.Lock()
+
+
+@contextmanager
+def timed(step: str):
+    """Record how long a startup step took, for the startup report."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _steps_lock:
+            _startup_steps.append({'step': step, 'seconds': round(seconds, 3)})
+        logger.info(f"{step}: {seconds:.2f}s")
+
+
+class LazyResource:
+    """Created on first use by its loader, exactly once even when many threads ask at the same time.
+
+    A failed load is not cached: the error is reported and the next call tries again.
+    """
+
+    def __init__(self, name: str, loader: Callable):
+        self.name = name
+        self.loader = loader
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.seconds = None
+        self.error = None
+        self.__doc__ = loader.__doc__
+
+    def __call__(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                try:
+                    with timed(f"load {self.name}"):
+                        value = self.loader()
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.seconds = time.perf_counter() - start
+                self._value = value
+                self.error = None
+                self._loaded = True
+        return self._value
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def status(self) -> Dict:
+        return {
+            'loaded': self._loaded,
+            'seconds': round(self.seconds, 3) if self.seconds is not None else None,
+            'error': self.error
+        }
+
+
+_registry: 'OrderedDict[str, LazyResource]' = OrderedDict()
+
+
+def lazy(name: str) -> Callable[[Callable], LazyResource]:
+    """Decorator registering a loader; calling the result returns the shared instance."""
+    def register(loader: Callable) -> LazyResource:
+        resource = LazyResource(name, loader)
+        _registry[name] = resource
+        return resource
+    return register
+
+
+def warmup(names: Optional[Iterable[str]] = None, max_workers: int = 4) -> Dict:
+    """Load resources in parallel (all registered ones by default) and return the startup report.
+
+    Loads that depend on each other (e.g. the corpus store on the SBERT model) wait for
+    the shared instance instead of loading it twice.
+    """
+    resources = [_registry[name] for name in (names or _registry)]
+    with timed('warmup'):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(resources) or 1))) as pool:
+            futures = [(resource, pool.submit(resource)) for resource in resources]
+            for resource, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Warm-up of {resource.name} failed: {e}")
+    return startup_report()
+
+
+def ready() -> bool:
+    return all(resource.loaded for resource in _registry.values())
+
+
+def startup_report() -> Dict:
+    with _steps_lock:
+        steps = list(_startup_steps)
+    return {
+        'ready': ready(),
+        'resources': {name: resource.status() for name, resource in _registry.items()},
+        'steps': steps
+    }
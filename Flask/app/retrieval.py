@@ -0,0 +1,281 @@
+"""
+In-memory indexes used to score stored conditions against a question
+"""
+
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale every row to unit length, leaving all-zero rows untouched."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k highest scores, best first, without sorting the whole array."""
+    if top_k <= 0 or len(scores) == 0:
+        return np.array([], dtype=np.int64)
+    if top_k < len(scores):
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class IVFIndex:
+    """Inverted-file approximate index: spherical k-means centroids, each row listed under its nearest one.
+
+    A search scores the centroids, then only the rows in the nprobe best lists, so its
+    cost depends on nlist and the list sizes rather than on the whole corpus.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        # Rows grouped by list: rows of list i are order[offsets[i]:offsets[i + 1]]
+        self.order = np.argsort(self.assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(self.assignments, minlength=len(self.centroids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        # Last measured recall@10 and the nprobe it was measured at
+        self.recall = None
+        self.recall_nprobe = None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @staticmethod
+    def default_nlist(n: int) -> int:
+        return int(max(1, min(n // 8, 4 * np.sqrt(n))))
+
+    @staticmethod
+    def assign(embeddings: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+        """Nearest centroid of every row, in chunks to bound memory."""
+        assignments = np.empty(len(embeddings), dtype=np.int32)
+        for start in range(0, len(embeddings), chunk_size):
+            assignments[start:start + chunk_size] = np.argmax(embeddings[start:start + chunk_size] @ centroids.T, axis=1)
+        return assignments
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, nlist: Optional[int] = None, iterations: int = 10,
+              sample_size: int = 256, seed: int = 0) -> 'IVFIndex':
+        """Train centroids with spherical k-means on at most sample_size rows per list, then assign every row."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        n = len(embeddings)
+        nlist = max(1, min(nlist or cls.default_nlist(n), n))
+        rng = np.random.default_rng(seed)
+        sample = embeddings[rng.choice(n, min(n, nlist * sample_size), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = cls.assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=nlist) == 0
+            # Empty lists restart from random rows instead of disappearing
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        return cls(centroids, cls.assign(embeddings, centroids))
+
+    @classmethod
+    def from_centroids(cls, centroids: np.ndarray, embeddings: np.ndarray) -> 'IVFIndex':
+        """Rebuild the lists of a stored index; one assignment pass, no k-means."""
+        centroids = np.asarray(centroids, dtype=np.float32)
+        return cls(centroids, cls.assign(np.asarray(embeddings, dtype=np.float32), centroids))
+
+    def candidates(self, query_embedding: np.ndarray, nprobe: int) -> np.ndarray:
+        """Row indices in the nprobe lists whose centroids are closest to the query."""
+        nprobe = max(1, min(nprobe, self.nlist))
+        probes = top_k_indices(self.centroids @ np.asarray(query_embedding, dtype=np.float32), nprobe)
+        return np.concatenate([self.order[self.offsets[p]:self.offsets[p + 1]] for p in probes])
+
+    def measure_recall(self, embeddings: np.ndarray, nprobe: int, top_k: int = 10, queries: int = 100,
+                       seed: int = 0) -> float:
+        """Share of the exact top_k found among the candidates, using sampled rows as queries."""
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(embeddings), min(queries, len(embeddings)), replace=False)
+        found = 0
+        expected = 0
+        for row in rows:
+            exact = top_k_indices(embeddings @ embeddings[row], top_k)
+            found += len(np.intersect1d(exact, self.candidates(embeddings[row], nprobe)))
+            expected += len(exact)
+        self.recall = found / expected if expected else 1.0
+        self.recall_nprobe = nprobe
+        return self.recall
+
+
+class BM25Index:
+    """Inverted index over a term-count matrix with the BM25 weight of every posting precomputed.
+
+    A query only reads the postings of its own terms, so its cost grows with how common
+    those terms are rather than with the number of documents.
+    """
+
+    def __init__(self, counts, k1: float = 1.2, b: float = 0.75):
+        counts = counts.tocsc().astype(np.float32)
+        n_docs, n_terms = counts.shape
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        average_length = lengths.mean() if n_docs and lengths.mean() > 0 else 1.0
+        doc_freq = np.diff(counts.indptr)
+        self.idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        # Postings of term t are rows[indptr[t]:indptr[t + 1]] with weights at the same positions
+        self.indptr = counts.indptr
+        self.rows = counts.indices.astype(np.int32)
+        tf = counts.data
+        norm = k1 * (1 - b + b * lengths[self.rows] / average_length)
+        self.weights = (np.repeat(self.idf, doc_freq) * tf * (k1 + 1) / (tf + norm)).astype(np.float32)
+
+    def search(self, query_counts, depth: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, scores) of the depth best-scoring documents for a 1 x n_terms query count vector."""
+        terms = query_counts.indices
+        if len(terms) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        rows = np.concatenate([self.rows[self.indptr[t]:self.indptr[t + 1]] for t in terms])
+        weights = np.concatenate([
+            self.weights[self.indptr[t]:self.indptr[t + 1]] * count for t, count in zip(terms, query_counts.data)
+        ])
+        if len(rows) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        matched, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        best = top_k_indices(scores, depth)
+        return matched[best].astype(np.int64), scores[best].astype(np.float32)
+
+
+class EmbeddingIndex:
+    """Conditions of one transaction type with their normalized SBERT embeddings."""
+
+    def __init__(self, sentences: List[str], embeddings: np.ndarray, ann: Optional[IVFIndex] = None):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(sentences):
+            raise ValueError(
+                f"Expected {len(sentences)} embedding rows, got shape {embeddings.shape}"
+            )
+        self.sentences = list(sentences)
+        self.embeddings = normalize_rows(embeddings)
+        # Approximate index for large corpora; None means exact search
+        self.ann = ann
+
+    def __len__(self) -> int:
+        return len(self.sentences)
+
+    @property
+    def dim(self) -> int:
+        return self.embeddings.shape[1]
+
+    def similarities(self, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cosine similarity of every condition (or only the given rows) to a normalized query embedding."""
+        embeddings = self.embeddings if rows is None else self.embeddings[rows]
+        return embeddings @ np.asarray(query_embedding, dtype=np.float32)
+
+    def to_bytes(self) -> bytes:
+        return self.embeddings.astype(np.float32).tobytes()
+
+    @staticmethod
+    def vectors_from_bytes(data: bytes, dim: int) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.float32).reshape(-1, dim)
+
+
+class HybridScorer:
+    """Semantic and TF-IDF scoring of a corpus with one dense and one sparse product.
+
+    Large corpora are scored in two stages: BM25 over an inverted index (plus the IVF
+    lists, when the index has them) picks candidates, and only those are reranked.
+    """
+
+    def __init__(self, index: EmbeddingIndex, semantic_weight: float = 0.6, lexical_weight: float = 0.4,
+                 nprobe: int = 8, bm25_depth: int = 300):
+        self.index = index
+        self.semantic_weight = semantic_weight
+        self.lexical_weight = lexical_weight
+        # Lists searched per query when the index has an approximate index
+        self.nprobe = nprobe
+        # BM25 candidates reranked per query; 0 bypasses the lexical candidate stage
+        self.bm25_depth = bm25_depth
+        # TF-IDF and BM25 share one tokenization and count matrix
+        self.vectorizer = CountVectorizer(stop_words='english', ngram_range=(1, 2))
+        try:
+            counts = self.vectorizer.fit_transform([s.lower() for s in index.sentences])
+        except ValueError:
+            # Empty vocabulary (e.g. only stop words): rank on semantic scores alone
+            self.vectorizer = None
+            self.document_matrix = None
+            self.bm25 = None
+        else:
+            self.tfidf = TfidfTransformer()
+            self.document_matrix = self.tfidf.fit_transform(counts)
+            self.bm25 = BM25Index(counts) if bm25_depth > 0 and len(index) > bm25_depth else None
+        self.queries = 0
+        self.candidates_scored = 0
+
+    def query_counts(self, query: str):
+        return self.vectorizer.transform([query.lower()]) if self.vectorizer is not None else None
+
+    def lexical_scores(self, query: str, rows: Optional[np.ndarray] = None, query_counts=None) -> np.ndarray:
+        """Cosine similarity of the query's TF-IDF vector to every document row (or only the given rows)."""
+        if self.vectorizer is None:
+            return np.zeros(len(self.index) if rows is None else len(rows), dtype=np.float32)
+        if query_counts is None:
+            query_counts = self.query_counts(query)
+        query_vector = self.tfidf.transform(query_counts)
+        matrix = self.document_matrix if rows is None else self.document_matrix[rows]
+        return (matrix @ query_vector.T).toarray().ravel().astype(np.float32)
+
+    def scores(self, query: str, query_embedding: np.ndarray, rows: Optional[np.ndarray] = None,
+               query_counts=None) -> np.ndarray:
+        return (self.semantic_weight * self.index.similarities(query_embedding, rows)
+                + self.lexical_weight * self.lexical_scores(query, rows, query_counts))
+
+    def candidates(self, query_embedding: np.ndarray, query_counts=None, top_k: int = 5) -> Optional[np.ndarray]:
+        """Rows worth scoring, or None to score the whole corpus.
+
+        BM25 and IVF candidates are merged, so paraphrases without shared terms still reach
+        the reranker; without an IVF index too few BM25 hits fall back to the whole corpus.
+        """
+        rows = []
+        if self.bm25 is not None and query_counts is not None:
+            lexical, _ = self.bm25.search(query_counts, self.bm25_depth)
+            if self.index.ann is not None or len(lexical) >= top_k:
+                rows.append(lexical)
+        if self.index.ann is not None:
+            rows.append(self.index.ann.candidates(query_embedding, self.nprobe))
+        if not rows:
+            return None
+        return np.unique(np.concatenate(rows)) if len(rows) > 1 else rows[0]
+
+    def top_k(self, query: str, query_embedding: np.ndarray, top_k: int = 5) -> List[Tuple[str, float]]:
+        query_counts = self.query_counts(query)
+        rows = self.candidates(query_embedding, query_counts, top_k)
+        scores = self.scores(query, query_embedding, rows, query_counts)
+        self.queries += 1
+        self.candidates_scored += len(scores)
+        best = top_k_indices(scores, top_k)
+        if rows is not None:
+            return [(self.index.sentences[rows[i]], float(scores[i])) for i in best]
+        return [(self.index.sentences[i], float(scores[i])) for i in best]
+
+
+class CentroidTypeClassifier:
+    """Nearest-centroid transaction type classifier over trained condition embeddings."""
+
+    def __init__(self, indexes: Dict[str, EmbeddingIndex], min_score: float = 0.2):
+        self.types = [t_type for t_type, index in indexes.items() if index is not None and len(index)]
+        self.min_score = min_score
+        self.centroids = None
+        if self.types:
+            self.centroids = normalize_rows(
+                np.vstack([indexes[t_type].embeddings.mean(axis=0) for t_type in self.types])
+            )
+
+    def classify(self, query_embedding: np.ndarray) -> Tuple[Optional[str], float]:
+        """Same (type, score) contract as detect_transaction_type, in one matrix-vector product."""
+        if self.centroids is None:
+            return None, 0.0
+        scores = self.centroids @ np.asarray(query_embedding, dtype=np.float32)
+        best = int(np.argmax(scores))
+        if scores[best] > self.min_score:
+            return self.types[best], float(scores[best])
+        return None, 0.0
@@ -1,7 +1,4 @@
 from flask import Blueprint, request, jsonify, render_template, current_app
-import pdfplumber
-import openpyxl
-from docx import Document
 import re
 import os
 import json
@@ -9,22 +6,32 @@ from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import spacy
 from typing import List, Dict, Tuple
-import glob
 from pymongo import MongoClient
 import difflib
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 import dropbox
-from sentence_transformers import SentenceTransformer
-import torch
-import tempfile
 from .utils import (
-    clean_text, extract_key_phrases, calculate_semantic_similarity,
-    find_most_similar_sentences, categorize_transaction_question,
+    clean_text, categorize_transaction_question,
     extract_question_intent, format_answer_for_intent
 )
+from .embeddings import (
+    EmbeddingMemo, configure_model, embedding_cache_stats, encode_batcher_stats, padding_stats,
+    query_embedding_cache, set_model_name
+)
+from .question_analysis import QuestionAnalysis, TransactionTypeLabels, analyze_question
 from .web_scraper import create_web_scraper
+from .corpus import CorpusStore, ANN_EXACT_THRESHOLD as DEFAULT_ANN_EXACT_THRESHOLD
+from .dropbox_sync import DropboxMirror, no_progress
+from .local_dropbox import LocalDropboxClient
+from .cache import ResponseCache
+from .training import TrainingJobs
+from .scheduler import TrainingScheduler, parse_fallback_schedule, run_as_leader
+from .resources import lazy, warmup, startup_report, timed
+from .inference import inference_gate, configure_threads
+from .extraction import (
+    extract_text, extract_files, filter_sentences, default_workers, segmenter_name,
+    select_document_formats, logical_document_key, format_agreement, DEFAULT_FORMAT_PREFERENCE
+)
 
 # Load environment variables
 load_dotenv()
@@ -34,35 +41,142 @@ main = Blueprint('main', __name__)
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'xls', 'xlsx', 'txt'}
-sbert_model = SentenceTransformer('all-MiniLM-L6-v2')
-# Load spaCy model
-try:
-    nlp = spacy.load("en_core_web_md")
-except OSError:
-    nlp = spacy.load("en_core_web_sm")
-    print("Warning: Using small spaCy model. Install 'en_core_web_md' for better similarity matching.")
-
-nlp.add_pipe("sentencizer")
+SBERT_MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Models and clients are created on first use (or by /warmup), so importing this module is cheap
+@lazy('sbert_model')
+def get_sbert_model():
+    with timed('import torch/sentence_transformers'):
+        from sentence_transformers import SentenceTransformer
+    # Torch thread limits come from the inference CPU budget (TORCH_INTRA_OP_THREADS and friends)
+    configure_threads()
+    sbert_model = SentenceTransformer(SBERT_MODEL_NAME)
+    # Long scraped and uploaded sentences are truncated to ENCODE_MAX_SEQ_LENGTH word pieces
+    configure_model(sbert_model)
+    set_model_name(sbert_model, SBERT_MODEL_NAME)
+    return sbert_model
+
+@lazy('nlp')
+def get_nlp():
+    # Load spaCy model
+    try:
+        nlp = spacy.load("en_core_web_md")
+    except OSError:
+        nlp = spacy.load("en_core_web_sm")
+        print("Warning: Using small spaCy model. Install 'en_core_web_md' for better similarity matching.")
+    nlp.add_pipe("sentencizer")
+    return nlp
 
 APP_KEY = os.getenv("DROPBOX_APP_KEY")
 APP_SECRET = os.getenv("DROPBOX_APP_SECRET")
 REFRESH_TOKEN = os.getenv("DROPBOX_REFRESH_TOKEN")
 
-dbx = dropbox.Dropbox(
-    app_key=APP_KEY,
-    app_secret=APP_SECRET,
-    oauth2_refresh_token=REFRESH_TOKEN
-)
+# DROPBOX_LOCAL_ROOT serves a local folder through the Dropbox API surface (development, tests)
+DROPBOX_LOCAL_ROOT = os.getenv("DROPBOX_LOCAL_ROOT")
+
+@lazy('dropbox')
+def get_dropbox():
+    if DROPBOX_LOCAL_ROOT:
+        return LocalDropboxClient(DROPBOX_LOCAL_ROOT)
+    return dropbox.Dropbox(
+        app_key=APP_KEY,
+        app_secret=APP_SECRET,
+        oauth2_refresh_token=REFRESH_TOKEN
+    )
+
+# Persistent local mirror of the Dropbox training folder, reused across training runs
+TRAINING_MIRROR_DIR = os.getenv('TRAINING_MIRROR_DIR', os.path.expanduser('~/.cache/chatbot/training_mirror'))
+TRAINING_MIRROR_QUOTA_MB = int(os.getenv('TRAINING_MIRROR_QUOTA_MB', '1024'))
+DROPBOX_DOWNLOAD_WORKERS = int(os.getenv('DROPBOX_DOWNLOAD_WORKERS', '4'))
+DROPBOX_DOWNLOAD_RETRIES = int(os.getenv('DROPBOX_DOWNLOAD_RETRIES', '3'))
+
+@lazy('training_mirror')
+def get_training_mirror():
+    return DropboxMirror(
+        get_dropbox(), TRAINING_MIRROR_DIR, quota_bytes=TRAINING_MIRROR_QUOTA_MB * 1024 * 1024,
+        download_workers=DROPBOX_DOWNLOAD_WORKERS, retries=DROPBOX_DOWNLOAD_RETRIES,
+        segmenter=segmenter_name(SEGMENTER)
+    )
+
+# Worker processes for training-time text extraction (1 extracts in-process)
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', str(default_workers())))
+# Training-time sentence splitting: 'sentencizer' (rules) or 'senter' (statistical), batched with nlp.pipe
+SEGMENTER = os.getenv('SEGMENTER', 'sentencizer')
+SEGMENTATION_BATCH_SIZE = int(os.getenv('SEGMENTATION_BATCH_SIZE', '32'))
+SEGMENTATION_PROCESSES = int(os.getenv('SEGMENTATION_PROCESSES', '1'))
+
+# The training folder holds each document in several formats; extract only the cheapest one
+TRAINING_DEDUPLICATE_FORMATS = os.getenv('TRAINING_DEDUPLICATE_FORMATS', '1') == '1'
+TRAINING_FORMAT_PREFERENCE = [
+    ext.strip().lower()
+    for ext in os.getenv('TRAINING_FORMAT_PREFERENCE', ','.join(DEFAULT_FORMAT_PREFERENCE)).split(',')
+    if ext.strip()
+]
+# Share of documents for which one other format is also extracted and compared
+TRAINING_VERIFY_SAMPLE_RATE = float(os.getenv('TRAINING_VERIFY_SAMPLE_RATE', '0'))
+TRAINING_VERIFY_MIN_AGREEMENT = float(os.getenv('TRAINING_VERIFY_MIN_AGREEMENT', '0.5'))
+
+# Retraining on Dropbox changes: 'longpoll' (default), 'poll' (cursor diff every interval) or 'off'
+TRAINING_WATCH_MODE = os.getenv('TRAINING_WATCH_MODE', 'longpoll')
+TRAINING_DEBOUNCE_SECONDS = float(os.getenv('TRAINING_DEBOUNCE_SECONDS', '30'))
+TRAINING_MAX_DELAY_SECONDS = float(os.getenv('TRAINING_MAX_DELAY_SECONDS', '600'))
+TRAINING_LONGPOLL_TIMEOUT = int(os.getenv('TRAINING_LONGPOLL_TIMEOUT', '120'))
+TRAINING_POLL_INTERVAL = float(os.getenv('TRAINING_POLL_INTERVAL', '60'))
+# Weekly run kept as a fallback, e.g. 'mon 09:00'; 'off' disables it
+TRAINING_FALLBACK_SCHEDULE = os.getenv('TRAINING_FALLBACK_SCHEDULE', 'mon 09:00')
+TRAINING_ON_START = os.getenv('TRAINING_ON_START', '1') == '1'
 
 # MongoDB Atlas configuration
-mongo_client = MongoClient(os.getenv('MONGODB_URI'))
 database_name = os.getenv('DATABASE_NAME')
 collection_name = os.getenv('COLLECTION_NAME')
-database = mongo_client[database_name]
-collection = database[collection_name]
+
+# Fail fast when MongoDB is unreachable, so requests fall back to the last good corpus
+# within a couple of seconds instead of the driver's 30 s server selection timeout
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGODB_SERVER_SELECTION_TIMEOUT_MS', '2000'))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv('MONGODB_CONNECT_TIMEOUT_MS', '2000'))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv('MONGODB_SOCKET_TIMEOUT_MS', '10000'))
+
+@lazy('mongodb')
+def get_collection():
+    mongo_client = MongoClient(
+        os.getenv('MONGODB_URI'),
+        serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS
+    )
+    database = mongo_client[database_name]
+    return database[collection_name]
+
+# Hybrid ranking weights for semantic (SBERT) and lexical (TF-IDF) similarity
+HYBRID_SEMANTIC_WEIGHT = float(os.getenv('HYBRID_SEMANTIC_WEIGHT', '0.6'))
+HYBRID_LEXICAL_WEIGHT = float(os.getenv('HYBRID_LEXICAL_WEIGHT', '0.4'))
+# How often (seconds) a worker re-reads the corpus generation document
+CORPUS_GENERATION_CHECK_INTERVAL = float(os.getenv('CORPUS_GENERATION_CHECK_INTERVAL', '5'))
+# Corpus versions kept in MongoDB for instant rollback, the active one included
+CORPUS_KEEP_VERSIONS = int(os.getenv('CORPUS_KEEP_VERSIONS', '3'))
+# Approximate (IVF) search for large types: minimum size, lists (0 = about 4 * sqrt(n)) and lists probed
+# per query; more probes trade latency for recall, which training logs for the configured value
+ANN_EXACT_THRESHOLD = int(os.getenv('ANN_EXACT_THRESHOLD', str(DEFAULT_ANN_EXACT_THRESHOLD)))
+ANN_NLIST = int(os.getenv('ANN_NLIST', '0'))
+ANN_NPROBE = max(1, int(os.getenv('ANN_NPROBE', '8')))
+# BM25 candidate stage: conditions passed on to the semantic reranker, and a switch to skip the stage
+BM25_CANDIDATES = int(os.getenv('BM25_CANDIDATES', '300'))
+BM25_BYPASS = os.getenv('BM25_BYPASS', '0') == '1'
+
+@lazy('corpus_store')
+def get_corpus_store():
+    return CorpusStore(
+        get_collection(), get_sbert_model(), SBERT_MODEL_NAME,
+        semantic_weight=HYBRID_SEMANTIC_WEIGHT, lexical_weight=HYBRID_LEXICAL_WEIGHT,
+        check_interval=CORPUS_GENERATION_CHECK_INTERVAL, keep_versions=CORPUS_KEEP_VERSIONS,
+        ann_threshold=ANN_EXACT_THRESHOLD, ann_nlist=ANN_NLIST or None, ann_nprobe=ANN_NPROBE,
+        bm25_depth=0 if BM25_BYPASS else BM25_CANDIDATES
+    )
 
 # Initialize web scraper
-web_scraper = create_web_scraper()
+@lazy('web_scraper')
+def get_web_scraper():
+    return create_web_scraper()
 
 # Transaction type keywords
 TRANSACTION_KEYWORDS = {
@@ -84,104 +198,43 @@ TRANSACTION_KEYWORDS = {
     ]
 }
 
-def allowed_file(filename: str) -> bool:
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# Answers to database-sourced questions, dropped whenever a training run bumps the corpus version
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '2048'))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '0'))
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL or None)
 
-def extract_text_from_pdf(file_path: str) -> str:
-    text = ""
-    with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                page_text = re.sub(r'\s+', ' ', page_text).strip()
-                text += page_text + "\n\n"
-    return text
+# Label vectors and keyword patterns are computed once instead of on every request
+@lazy('type_labels')
+def get_type_labels():
+    return TransactionTypeLabels(TRANSACTION_KEYWORDS, get_nlp())
 
+# 'keywords' (default) or 'centroid' to classify against trained condition embeddings
+TYPE_CLASSIFIER = os.getenv('TYPE_CLASSIFIER', 'keywords')
+CENTROID_MIN_SCORE = float(os.getenv('CENTROID_MIN_SCORE', '0.2'))
 
+def allowed_file(filename: str) -> bool:
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def filter_conditions_by_relevance(conditions: list, question_focus: list, question_doc, sbert_model, threshold: float = 0.25) -> list:
+def filter_conditions_by_relevance(conditions: list, question_focus: list, question_doc, sbert_model, threshold: float = 0.25,
+                                   memo: EmbeddingMemo = None) -> list:
     """Filter a list of conditions for relevance to the question using SBERT."""
-    return [
-        cond for cond in conditions
-        if calculate_relevance_score(cond, question_focus, question_doc, sbert_model) > threshold
-    ]
-def download_dropbox_folder(folder_path="/chatbot-training"):
-    """Download all files from Dropbox folder to a temp directory and return local path."""
-    tmp_dir = tempfile.mkdtemp()
-    result = dbx.files_list_folder(folder_path)
-    
-    for entry in result.entries:
-        if isinstance(entry, dropbox.files.FileMetadata):
-            local_path = os.path.join(tmp_dir, entry.name)
-            with open(local_path, "wb") as f:
-                metadata, res = dbx.files_download(entry.path_lower)
-                f.write(res.content)
-    
-    return tmp_dir
-def extract_text_from_excel(file_path: str) -> str:
-    text = ""
-    workbook = openpyxl.load_workbook(file_path, read_only=True)
-    for sheet in workbook:
-        for row in sheet.rows:
-            row_text = " ".join(str(cell.value) for cell in row if cell.value)
-            if row_text:
-                text += row_text + "\n"
-    return re.sub(r'\s+', ' ', text).strip()
-
-def extract_text_from_word(file_path: str) -> str:
-    doc = Document(file_path)
-    text = ""
-    for para in doc.paragraphs:
-        if para.text:
-            text += para.text + "\n"
-    return re.sub(r'\s+', ' ', text).strip()
-
-def extract_text(file_path: str) -> str:
-    extension = file_path.rsplit('.', 1)[1].lower()
-    try:
-        if extension == 'pdf':
-            return extract_text_from_pdf(file_path)
-        elif extension in ['xlsx', 'xls']:
-            return extract_text_from_excel(file_path)
-        elif extension == 'docx':
-            return extract_text_from_word(file_path)
-        elif extension == 'txt':
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return re.sub(r'\s+', ' ', f.read()).strip()
-        else:
-            return ""
-    except Exception as e:
-        print(f"Error extracting text from {file_path}: {e}")
-        return ""
-
+    memo = memo or EmbeddingMemo(sbert_model)
+    scores = memo.similarities(' '.join(question_focus), conditions)
+    return [cond for cond, score in zip(conditions, scores) if score > threshold]
 def preprocess_text(text: str) -> List[str]:
-    doc = nlp(text)
-    sentences = []
-    for sent in doc.sents:
-        s = sent.text.strip()
-        # Skip lines that look like table headers or section titles
-        if not s:
-            continue
-        if re.match(r'^(Summary|Condition Type|Details|Explanation|Requirements?|Procedures?|Restrictions?|Timeframes?|Fees|Section|Contact)\b', s, re.IGNORECASE):
-            continue
-        if len(s.split()) < 4:  # Skip very short lines
-            continue
-        sentences.append(s)
-    return sentences
-
-def detect_transaction_type(question: str) -> Tuple[str, float]:
-    question_lower = question.lower()
-    question_doc = nlp(question_lower)
-    keyword_scores = categorize_transaction_question(question)
-    semantic_scores = {}
-    for t_type in TRANSACTION_KEYWORDS.keys():
-        type_doc = nlp(t_type)
-        semantic_scores[t_type] = question_doc.similarity(type_doc)
-    key_phrases = extract_key_phrases(question, nlp)
-    phrase_scores = {}
-    for t_type, keywords in TRANSACTION_KEYWORDS.items():
-        matches = sum(1 for phrase in key_phrases if any(keyword in phrase for keyword in keywords))
-        phrase_scores[t_type] = matches / len(key_phrases) if key_phrases else 0
+    nlp = get_nlp()
+    with inference_gate.slot('spacy'):
+        doc = nlp(text)
+    return filter_sentences(sent.text for sent in doc.sents)
+
+def detect_transaction_type(analysis: QuestionAnalysis) -> Tuple[str, float]:
+    if TYPE_CLASSIFIER == 'centroid':
+        classifier = get_corpus_store().type_classifier(CENTROID_MIN_SCORE)
+        if classifier.types:
+            return classifier.classify(analysis.query_embedding(get_sbert_model()))
+    keyword_scores = categorize_transaction_question(analysis.question)
+    semantic_scores = get_type_labels().semantic_scores(analysis.doc)
+    phrase_scores = get_type_labels().phrase_scores(analysis.key_phrases)
     final_scores = {}
     for t_type in TRANSACTION_KEYWORDS.keys():
         keyword_score = keyword_scores.get(t_type, 0)
@@ -196,85 +249,177 @@ def detect_transaction_type(question: str) -> Tuple[str, float]:
             return best_type, best_score
     return None, 0.0
 
-def extract_question_focus(question: str) -> List[str]:
-    question_doc = nlp(question.lower())
-    focus_words = []
-    for token in question_doc:
-        if token.pos_ in ['NOUN', 'VERB', 'ADJ'] and not token.is_stop and not token.is_punct and len(token.text) > 2:
-            focus_words.append(token.lemma_.lower())
-    question_words = ['what', 'how', 'when', 'where', 'why', 'which', 'who']
-    for word in question_words:
-        if word in question.lower():
-            focus_words.append(word)
-    key_phrases = extract_key_phrases(question, nlp)
-    focus_words.extend(key_phrases)
-    return list(set(focus_words))
-
-
-def calculate_relevance_score(sentence: str, question_focus: List[str], question_doc, sbert_model) -> float:
-    # Use SBERT for semantic similarity
-    semantic_similarity = calculate_semantic_similarity(' '.join(question_focus), sentence, sbert_model)
-    return semantic_similarity
-def filter_relevant_sentences(sentences: List[str], question_focus: List[str], question_doc, sbert_model, threshold: float = 0.25) -> List[str]:
-    relevant_sentences = []
-    for sentence in sentences:
-        relevance = calculate_relevance_score(sentence, question_focus, question_doc, sbert_model)
-        if relevance > threshold:
-            relevant_sentences.append((sentence, relevance))
+def extract_question_focus(analysis: QuestionAnalysis) -> List[str]:
+    return analysis.focus_words
+
+def filter_relevant_sentences(sentences: List[str], question_focus: List[str], question_doc, sbert_model, threshold: float = 0.25,
+                              memo: EmbeddingMemo = None) -> List[str]:
+    memo = memo or EmbeddingMemo(sbert_model)
+    scores = memo.similarities(' '.join(question_focus), sentences)
+    relevant_sentences = [
+        (sentence, float(relevance)) for sentence, relevance in zip(sentences, scores)
+        if relevance > threshold
+    ]
     relevant_sentences.sort(key=lambda x: x[1], reverse=True)
     return [sent for sent, _ in relevant_sentences[:8]]
 
 def process_urls_in_question(question: str, transaction_type: str) -> List[Dict]:
     try:
-        return web_scraper.process_urls_in_question(question, transaction_type)
+        return get_web_scraper().process_urls_in_question(question, transaction_type)
     except Exception as e:
         print(f"Error processing URLs: {e}")
         return []
 
-def train_chatbot(folder_path="/chatbot-training") -> None:
-    training_folder = download_dropbox_folder(folder_path)
-    if not os.path.exists(training_folder):
-        print(f"Training folder {training_folder} not found.")
-        return
-    conditions_by_type = {}
-    for file_path in glob.glob(os.path.join(training_folder, '*')):
-        if allowed_file(file_path):
-            base_name = os.path.basename(file_path).lower()
-            transaction_type = None
-            for t_type in ['refunds', 'payments', 'exchanges', 'transfers']:
-                if t_type in base_name:
-                    transaction_type = t_type
-                    break
-            if not transaction_type:
-                transaction_type = base_name.rsplit('_v', 1)[0]
-            text = extract_text(file_path)
-            if text:
-                sentences = preprocess_text(text)
-                if transaction_type not in conditions_by_type:
-                    conditions_by_type[transaction_type] = set()
-                conditions_by_type[transaction_type].update(sentences)
-                print(f"Processed conditions for {transaction_type} from {file_path}")
-            else:
-                print(f"Failed to extract text from {file_path}")
-    for transaction_type, sentences in conditions_by_type.items():
-        unique_id = f"{transaction_type}_consolidated"
-        collection.update_one(
-            {'id': unique_id},
-            {'$set': {'transaction_type': transaction_type, 'conditions': list(sentences)}},
-            upsert=True
-        )
-        print(f"Trained and saved deduplicated conditions for {transaction_type}")
+def transaction_type_for_file(file_name: str) -> str:
+    base_name = os.path.basename(file_name).lower()
+    for t_type in ['refunds', 'payments', 'exchanges', 'transfers']:
+        if t_type in base_name:
+            return t_type
+    return base_name.rsplit('_v', 1)[0]
+
+def training_file_roles(file_names: List[str]) -> Dict[str, str]:
+    """'primary' or 'verify' for every training file that should be extracted."""
+    file_names = [name for name in file_names if allowed_file(name)]
+    if not TRAINING_DEDUPLICATE_FORMATS:
+        return {name: 'primary' for name in file_names}
+    return select_document_formats(file_names, TRAINING_FORMAT_PREFERENCE, TRAINING_VERIFY_SAMPLE_RATE)
+
+def select_training_entries(entries: List) -> List:
+    roles = training_file_roles([entry.name for entry in entries])
+    return [entry for entry in entries if entry.name in roles]
+
+def train_chatbot(folder_path="/chatbot-training", force: bool = False, progress=None) -> Dict:
+    """Sync, extract, embed and store the training corpus; progress(stage, done, total) reports each stage."""
+    training_mirror = get_training_mirror()
+    # Runs are serialized across workers, but the last one may have run in another process
+    training_mirror.reload_manifest()
+    corpus_store = get_corpus_store()
+    progress = progress or no_progress
+    sync = training_mirror.sync(folder_path, select=select_training_entries, progress=progress)
+    failed = [download.path for download in sync.downloads if download.error]
+    print(f"Training mirror: {len(sync.changed)} new or changed, {len(sync.unchanged)} unchanged, "
+          f"{len(sync.deleted)} deleted, {len(failed)} failed downloads")
+
+    # Only new or changed files are extracted; everything else comes from the sentence cache
+    local_paths = {path: training_mirror.local_path(path) for path in sync.changed}
+    results = extract_files(
+        [p for p in local_paths.values() if allowed_file(p)], EXTRACTION_WORKERS,
+        mode=SEGMENTER, batch_size=SEGMENTATION_BATCH_SIZE, n_process=SEGMENTATION_PROCESSES,
+        progress=lambda done, total: progress('extracting', done, total)
+    )
+    for path, local_path in local_paths.items():
+        result = results.get(local_path)
+        if result is None:
+            training_mirror.store_sentences(path, [])
+        elif result.error:
+            # Keeps serving the previous version of the file; the next run extracts it again
+            print(f"Failed to extract text from {local_path}: {result.error}")
+            training_mirror.extraction_failed(path)
+        else:
+            training_mirror.store_sentences(path, result.sentences)
+            print(f"Processed conditions from {local_path} in {result.seconds:.2f}s")
+    training_mirror.enforce_quota()
+
+    summary = {
+        'changed': len(sync.changed),
+        'unchanged': len(sync.unchanged),
+        'deleted': len(sync.deleted),
+        'failed_downloads': len(failed),
+        'failed_extractions': sum(1 for result in results.values() if result.error),
+        'skipped': False
+    }
+    fingerprint = training_mirror.fingerprint()
+    if not force and fingerprint == training_mirror.manifest.get('trained_fingerprint'):
+        print("Training files unchanged since the last run; corpus is up to date.")
+        summary['skipped'] = True
+        return summary
+
+    roles = training_file_roles([record['name'] for record in training_mirror.files.values()])
+    primaries = {}
+    for path, record in training_mirror.files.items():
+        if roles.get(record['name']) == 'primary':
+            primaries[logical_document_key(record['name'])] = path
 
-def get_conditions_from_db(transaction_type: str) -> List[str]:
-    try:
-        items = collection.find({'transaction_type': transaction_type})
-        conditions = []
-        for item in items:
-            conditions.extend(item.get('conditions', []))
-        return list(dict.fromkeys(conditions))
-    except Exception as e:
-        print(f"Error querying MongoDB for {transaction_type}: {e}")
-        return []
+    conditions_by_type = {}
+    for path, record in training_mirror.files.items():
+        sentences = training_mirror.load_sentences(path)
+        if not sentences:
+            continue
+        if roles.get(record['name']) == 'verify':
+            primary = primaries.get(logical_document_key(record['name']))
+            primary_sentences = training_mirror.load_sentences(primary) if primary else None
+            agreement = format_agreement(primary_sentences or [], sentences)
+            if agreement >= TRAINING_VERIFY_MIN_AGREEMENT:
+                continue
+            # The formats have diverged: keep both rather than lose conditions
+            print(f"Warning: {record['name']} agrees only {agreement:.2f} with the extracted format of the same document")
+        transaction_type = transaction_type_for_file(record['name'])
+        # sentence -> the training files it came from
+        conditions = conditions_by_type.setdefault(transaction_type, {})
+        for sentence in sentences:
+            conditions.setdefault(sentence, set()).add(record['name'])
+    indexes = {}
+    progress('embedding', 0, len(conditions_by_type))
+    for transaction_type, conditions in conditions_by_type.items():
+        # Only sentences new to this type are encoded; stored embeddings are reused
+        indexes[transaction_type] = corpus_store.build_index(sorted(conditions), transaction_type)
+        progress('embedding', len(indexes), len(conditions_by_type))
+
+    # Large types get an IVF index so query latency does not grow with the corpus
+    large = [t_type for t_type, index in indexes.items() if len(index) >= corpus_store.ann_threshold]
+    progress('indexing', 0, len(large))
+    for done, transaction_type in enumerate(large, 1):
+        corpus_store.build_ann(indexes[transaction_type])
+        progress('indexing', done, len(large))
+
+    # The whole corpus goes into a new version; readers switch to it in one step once it is complete
+    removed = [t_type for t_type in corpus_store.transaction_types() if t_type not in conditions_by_type]
+    progress('writing', 0, sum(len(index) for index in indexes.values()))
+    version = corpus_store.begin_version()
+    corpus_store.write_version(
+        version, indexes, sources=conditions_by_type,
+        progress=lambda done, total: progress('writing', done, total)
+    )
+    summary['corpus_generation'] = corpus_store.activate(version, indexes)
+    print(f"Activated corpus version {version} with {', '.join(sorted(indexes)) or 'no transaction types'}")
+    for transaction_type in removed:
+        print(f"Removed {transaction_type}: its training files were deleted")
+    summary['corpus_version'] = version
+    summary['conditions'] = {t_type: len(index) for t_type, index in indexes.items()}
+    summary['removed_types'] = removed
+
+    if summary['failed_downloads'] or summary['failed_extractions']:
+        # Not recorded as trained, so the next run trains even if the retried files match this fingerprint
+        training_mirror.manifest['trained_fingerprint'] = None
+    else:
+        training_mirror.manifest['trained_fingerprint'] = fingerprint
+    training_mirror.save_manifest()
+    return summary
+
+# Single-flight background training shared by /train and the scheduler started in run.py
+# Lock files and job state shared by every worker process on this machine
+TRAINING_STATE_DIR = os.getenv('TRAINING_STATE_DIR', os.path.join(os.path.dirname(TRAINING_MIRROR_DIR), 'training_state'))
+training_jobs = TrainingJobs(train_chatbot, state_dir=TRAINING_STATE_DIR)
+training_scheduler = None
+
+def start_training_scheduler(folder_path: str) -> None:
+    """Retrain when the Dropbox folder changes, with the weekly run as a fallback.
+
+    Safe to call from every worker: only the process holding the scheduler lock runs it,
+    and another worker takes over if that process exits.
+    """
+    def start():
+        global training_scheduler
+        if training_scheduler is None:
+            training_scheduler = TrainingScheduler(
+                get_dropbox(), training_jobs, folder_path,
+                debounce=TRAINING_DEBOUNCE_SECONDS, max_delay=TRAINING_MAX_DELAY_SECONDS,
+                mode=TRAINING_WATCH_MODE, longpoll_timeout=TRAINING_LONGPOLL_TIMEOUT,
+                poll_interval=TRAINING_POLL_INTERVAL,
+                fallback=parse_fallback_schedule(TRAINING_FALLBACK_SCHEDULE),
+                run_on_start=TRAINING_ON_START
+            ).start()
+    run_as_leader(os.path.join(TRAINING_STATE_DIR, 'scheduler.lock'), start)
 
 
 def generate_focused_answer(
@@ -284,7 +429,8 @@ def generate_focused_answer(
     url_data: List[Dict] = None,
     file_content: str = None,
     question_focus: List[str] = None,
-    question_doc = None
+    question_doc = None,
+    embedding_memo: EmbeddingMemo = None
 ) -> str:
     def dedup_and_clean(sentences: List[str]) -> List[str]:
         seen = set()
@@ -318,10 +464,15 @@ def generate_focused_answer(
 
     if file_content:
         answer = f"📄 **Information from uploaded file about {transaction_type}:**\n\n"
-        transaction_conditions = web_scraper.extract_transaction_conditions(file_content, transaction_type)
+        transaction_conditions = get_web_scraper().extract_transaction_conditions(file_content, transaction_type)
         if question_focus is not None and question_doc is not None:
+            memo = embedding_memo or EmbeddingMemo(get_sbert_model())
+            # Encode the focus text and every candidate condition in one batch up front
+            memo.encode([' '.join(question_focus)] + [
+                item for val in transaction_conditions.values() if isinstance(val, list) for item in val
+            ])
             filtered_conditions = {
-                key: filter_conditions_by_relevance(val, question_focus, question_doc, sbert_model)
+                key: filter_conditions_by_relevance(val, question_focus, question_doc, get_sbert_model(), memo=memo)
                 for key, val in transaction_conditions.items() if isinstance(val, list)
             }
         else:
@@ -362,7 +513,7 @@ def generate_focused_answer(
         return f"No specific information found about {question.lower()} for {transaction_type}."
 
     deduped = dedup_and_clean(relevant_sentences)
-    groups = group_sentences(deduped, sbert_model)
+    groups = group_sentences(deduped, get_sbert_model())
 
     answer = f"**Here's what I found about {transaction_type} (organized):**\n\n"
     for section, items in groups.items():
@@ -398,7 +549,7 @@ def generate_focused_answer(
         return f"No specific information found about {question.lower()} for {transaction_type}."
 
     deduped = dedup_and_clean(relevant_sentences)
-    groups = group_sentences(deduped, sbert_model)
+    groups = group_sentences(deduped, get_sbert_model())
 
     answer = f"**Here's what I found about {transaction_type} (organized):**\n\n"
     for section, items in groups.items():
@@ -415,8 +566,23 @@ def index():
 @main.route('/train', methods=['POST'])
 def trigger_training():
     training_folder = os.path.join(current_app.config.get('TRAINING_FOLDER', 'training_data'))
-    train_chatbot(training_folder)
-    return jsonify({'message': 'Training completed and conditions saved to MongoDB Atlas.'})
+    force = request.values.get('force', '').lower() in ('1', 'true', 'yes')
+    job, created = training_jobs.submit(training_folder, force=force, trigger='api')
+    message = 'Training started.' if created else 'Training is already running; joined the active job.'
+    return jsonify({
+        'message': message,
+        'job_id': job.id,
+        'status_url': f"/train/{job.id}",
+        'job': job.to_dict()
+    }), 202
+
+@main.route('/train/<job_id>', methods=['GET'])
+def training_status(job_id):
+    # Any worker can answer: jobs started by other workers are read from the shared state dir
+    status = training_jobs.status(job_id)
+    if status is None:
+        return jsonify({'error': f'Unknown training job {job_id}.'}), 404
+    return jsonify(status)
 
 
 @main.route('/chat', methods=['POST'])
@@ -427,7 +593,21 @@ def chat():
         return jsonify({'answer': 'Please provide a question or upload a file.'}), 400
 
     question = clean_text(question) if question else ""
-    transaction_type, confidence_score = detect_transaction_type(question) if question else (None, 0.0)
+
+    # Database answers depend only on the cleaned question and the trained corpus;
+    # file uploads and questions with URLs are never cached
+    corpus_version = get_corpus_store().current_version()
+    cacheable = bool(question) and not file and not (get_web_scraper().extract_urls_from_text(question))
+    if cacheable:
+        cached_response = response_cache.lookup(question, corpus_version)
+        if cached_response is not None:
+            return jsonify(cached_response)
+
+    # Parse the question once; every step below reads from this analysis
+    nlp = get_nlp()
+    with inference_gate.slot('spacy'):
+        analysis = analyze_question(question, nlp)
+    transaction_type, confidence_score = detect_transaction_type(analysis) if question else (None, 0.0)
     
     if not transaction_type and file:
         transaction_type = 'refunds'  # Default for file uploads if no question
@@ -435,8 +615,8 @@ def chat():
     elif not transaction_type:
         return jsonify({'answer': 'Could not identify a transaction type. Please include terms like "refunds", "payments", "transfers", or "exchanges".'}), 400
 
-    question_focus = extract_question_focus(question) if question else []
-    question_doc = nlp(question.lower()) if question else nlp("")
+    question_focus = extract_question_focus(analysis) if question else []
+    question_doc = analysis.doc
     
     file_content = None
     file_path = None
@@ -451,24 +631,26 @@ def chat():
             return jsonify({'answer': f"Failed to extract content from {filename}."}), 400
 
     urls_processed = []
-    if question and web_scraper:
-        urls = web_scraper.extract_urls_from_text(question)
+    if question:
+        urls = get_web_scraper().extract_urls_from_text(question)
         if urls:
-            urls_processed = web_scraper.process_urls_in_question(question, transaction_type)
+            urls_processed = get_web_scraper().process_urls_in_question(question, transaction_type)
             print(f"Processed {len(urls_processed)} URLs: {urls}")
     
     if file_content:
         relevant_sentences = []
+        embedding_memo = EmbeddingMemo(get_sbert_model())
         if question:
             sentences = preprocess_text(file_content)
-            relevant_sentences = filter_relevant_sentences(sentences, question_focus, question_doc,sbert_model)
+            relevant_sentences = filter_relevant_sentences(sentences, question_focus, question_doc, get_sbert_model(), memo=embedding_memo)
         answer = generate_focused_answer(
             question,
             relevant_sentences,
             transaction_type,
             file_content=file_content,
             question_focus=question_focus,
-            question_doc=question_doc
+            question_doc=question_doc,
+            embedding_memo=embedding_memo
         )
         return jsonify({
             'answer': answer,
@@ -497,11 +679,13 @@ def chat():
             'source': 'web_scraping'
         })
     
-    all_sentences = get_conditions_from_db(transaction_type)
-    relevant_sentences = find_most_similar_sentences(question, all_sentences, sbert_model, top_k=5)
+    scorer = get_corpus_store().get_scorer(transaction_type)
+    relevant_sentences = []
+    if scorer is not None:
+        relevant_sentences = scorer.top_k(question, analysis.query_embedding(get_sbert_model()), top_k=5)
     answer = generate_focused_answer(question, [sentence for sentence, _ in relevant_sentences], transaction_type, urls_processed)
     
-    return jsonify({
+    response = {
         'answer': answer,
         'transaction_type': transaction_type,
         'confidence': confidence_score,
@@ -509,6 +693,56 @@ def chat():
         'question_focus': question_focus[:5],
         'urls_processed': len(urls_processed),
         'source': 'database'
+    }
+    # An answer built while MongoDB was unreachable (no scorer, or the last good copy of an
+    # older generation) must not be served for the rest of this generation
+    if cacheable and get_corpus_store().loaded_at(transaction_type) == corpus_version:
+        response_cache.store(question, corpus_version, response)
+    return jsonify(response)
+
+@main.route('/corpus/versions', methods=['GET'])
+def corpus_versions():
+    return jsonify(get_corpus_store().versions())
+
+@main.route('/corpus/rollback', methods=['POST'])
+def corpus_rollback():
+    corpus_store = get_corpus_store()
+    version = request.values.get('version')
+    try:
+        generation = corpus_store.rollback(int(version) if version else None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'message': f'Now serving corpus version {corpus_store.active_version}.',
+        'active_version': corpus_store.active_version,
+        'generation': generation
+    })
+
+@main.route('/health', methods=['GET'])
+def health():
+    """Liveness: answers as soon as the app is imported, without loading any model."""
+    report = startup_report()
+    return jsonify({'status': 'ok', 'ready': report['ready']})
+
+@main.route('/warmup', methods=['GET', 'POST'])
+def warmup_resources():
+    """Load every model and client in parallel; 200 once all are ready, 503 with the failures otherwise."""
+    report = warmup()
+    return jsonify(report), 200 if report['ready'] else 503
+
+@main.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({
+        'query_embedding_cache': query_embedding_cache.stats(),
+        'response_cache': response_cache.stats(),
+        'training': training_jobs.stats(),
+        'training_scheduler': training_scheduler.stats() if training_scheduler else None,
+        'startup': startup_report(),
+        'inference': inference_gate.stats(),
+        'encode_batcher': encode_batcher_stats(),
+        'encode_padding': padding_stats.stats(),
+        'embedding_cache': embedding_cache_stats(),
+        'retrieval': get_corpus_store().retrieval_stats() if get_corpus_store.loaded else None
     })
 
 @main.route('/reload_training', methods=['POST'])
@@ -0,0 +1,239 @@
+"""
+Change-driven training scheduler: follows the Dropbox folder cursor, debounces bursts of
+uploads and keeps a weekly run as a fallback
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+import dropbox
+from .locks import flock_exclusive
+from .training import TrainingJobs
+
+logger = logging.getLogger(__name__)
+
+# Dropbox accepts longpoll timeouts between 30 and 480 seconds
+LONGPOLL_MIN_TIMEOUT = 30
+LONGPOLL_MAX_TIMEOUT = 480
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def parse_fallback_schedule(spec: str) -> Optional[Tuple[int, int, int]]:
+    """'mon 09:00' -> (weekday, hour, minute); an empty string or 'off' disables the fallback."""
+    spec = (spec or '').strip().lower()
+    if not spec or spec == 'off':
+        return None
+    day, clock = spec.split()
+    hour, minute = clock.split(':')
+    return WEEKDAYS.index(day[:3]), int(hour), int(minute)
+
+
+def next_fallback_run(schedule: Tuple[int, int, int], now: datetime.datetime) -> datetime.datetime:
+    weekday, hour, minute = schedule
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    candidate += datetime.timedelta(days=(weekday - now.weekday()) % 7)
+    if candidate <= now:
+        candidate += datetime.timedelta(days=7)
+    return candidate
+
+
+# Open lock files of leases this process holds; closing one would release the lock
+_held_locks = []
+
+
+def run_as_leader(lock_path: str, start: Callable[[], None], retry_interval: float = 30.0) -> threading.Thread:
+    """Call start() in exactly one of the processes sharing lock_path.
+
+    The process holding an exclusive flock on lock_path is the leader; the others keep
+    retrying, so when the leader exits (e.g. a restarted worker) another one takes over.
+    """
+    def acquire():
+        lock_file = open(lock_path, 'a')
+        while not flock_exclusive(lock_file, blocking=False):
+            time.sleep(retry_interval)
+        _held_locks.append(lock_file)
+        logger.info(f"Process {os.getpid()} owns {os.path.basename(lock_path)}")
+        start()
+
+    thread = threading.Thread(target=acquire, name='leader-lock', daemon=True)
+    thread.start()
+    return thread
+
+
+class TrainingScheduler:
+    """Starts incremental training when files in the Dropbox folder change.
+
+    A watcher thread long-polls the folder cursor (or, with mode='poll', diffs it every
+    poll_interval seconds; mode='off' disables watching) and records changed files. A
+    trigger thread waits until no change has arrived for debounce seconds, or max_delay
+    has passed since the first pending change, and then submits a training job. The fallback schedule still submits
+    a run once a week, and run_on_start catches up on changes made while the app was down;
+    with an unchanged folder those runs end after the listing step.
+    """
+
+    def __init__(self, client, jobs: TrainingJobs, folder_path: str, debounce: float = 30.0,
+                 max_delay: float = 600.0, mode: str = 'longpoll', longpoll_timeout: int = 120,
+                 poll_interval: float = 60.0, fallback: Optional[Tuple[int, int, int]] = (0, 9, 0),
+                 run_on_start: bool = True, clock=time.monotonic):
+        self.client = client
+        self.jobs = jobs
+        self.folder_path = folder_path
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.mode = mode
+        self.longpoll_timeout = max(LONGPOLL_MIN_TIMEOUT, min(LONGPOLL_MAX_TIMEOUT, longpoll_timeout))
+        self.poll_interval = poll_interval
+        self.fallback = fallback
+        self.run_on_start = run_on_start
+        self.clock = clock
+        self._cursor = None
+        self._first_change = None
+        self._last_change = None
+        self._pending_paths = set()
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads = []
+        self.triggered = {'startup': 0, 'change': 0, 'schedule': 0}
+        self.changes_seen = 0
+        self.watch_errors = 0
+
+    def start(self) -> 'TrainingScheduler':
+        if self.run_on_start:
+            self._submit('startup', 'catching up on changes since the last run')
+        targets = [('training-trigger', self._trigger_loop)]
+        if self.mode != 'off':
+            targets.append(('training-watcher', self._watch))
+        for name, target in targets:
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Training scheduler watching {self.folder_path} ({self.mode}, debounce {self.debounce:g}s)")
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # Watcher
+
+    def _latest_cursor(self) -> str:
+        return self.client.files_list_folder_get_latest_cursor(self.folder_path).cursor
+
+    def _read_changes(self) -> None:
+        """Follow the cursor to its end and record the files that changed."""
+        paths = set()
+        has_more = True
+        while has_more:
+            result = self.client.files_list_folder_continue(self._cursor)
+            for entry in result.entries:
+                if isinstance(entry, (dropbox.files.FileMetadata, dropbox.files.DeletedMetadata)):
+                    paths.add(entry.path_lower)
+            self._cursor = result.cursor
+            has_more = result.has_more
+        if paths:
+            self.notify_changes(paths)
+
+    def notify_changes(self, paths) -> None:
+        """Record changed files; training starts once the burst settles."""
+        now = self.clock()
+        with self._condition:
+            self._pending_paths.update(paths)
+            self.changes_seen += len(paths)
+            if self._first_change is None:
+                self._first_change = now
+            self._last_change = now
+            self._condition.notify_all()
+        logger.info(f"Training folder changed: {len(paths)} files")
+
+    def _wait_for_changes(self) -> bool:
+        if self.mode == 'poll':
+            self._stopped.wait(self.poll_interval)
+            return True
+        result = self.client.files_list_folder_longpoll(self._cursor, timeout=self.longpoll_timeout)
+        if result.backoff:
+            # Dropbox asks clients to wait before the next longpoll
+            self._stopped.wait(result.backoff)
+        return result.changes
+
+    def _watch(self) -> None:
+        failures = 0
+        while not self._stopped.is_set():
+            try:
+                if self._cursor is None:
+                    self._cursor = self._latest_cursor()
+                if self._wait_for_changes() and not self._stopped.is_set():
+                    self._read_changes()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                self.watch_errors += 1
+                delay = min(300, 2 ** failures)
+                logger.warning(f"Watching {self.folder_path} failed, retrying in {delay}s: {e}")
+                if isinstance(e, dropbox.exceptions.ApiError):
+                    # Expired or reset cursor: start again from the current state; the
+                    # fallback run and the next change pick up anything missed meanwhile
+                    self._cursor = None
+                self._stopped.wait(delay)
+
+    # Trigger
+
+    def _due(self, now: float) -> Optional[float]:
+        """Seconds until pending changes should be trained on (0 when due), None when nothing is pending."""
+        if self._last_change is None:
+            return None
+        return max(0.0, min(self._last_change + self.debounce, self._first_change + self.max_delay) - now)
+
+    def _trigger_loop(self) -> None:
+        next_fallback = self._next_fallback()
+        while not self._stopped.is_set():
+            with self._condition:
+                wait = self._due(self.clock())
+                if wait is None or wait > 0:
+                    until_fallback = (next_fallback - datetime.datetime.now()).total_seconds() if next_fallback else None
+                    timeouts = [t for t in (wait, until_fallback, 60.0) if t is not None]
+                    self._condition.wait(max(0.0, min(timeouts)))
+                    wait = self._due(self.clock())
+                if wait == 0 and self.jobs.active is None:
+                    # Never join a running job: it may have listed the folder before these changes
+                    changed = len(self._pending_paths)
+                    self._pending_paths.clear()
+                    self._first_change = self._last_change = None
+                else:
+                    changed = None
+            if self._stopped.is_set():
+                break
+            if changed is not None:
+                self._submit('change', f"{changed} changed files")
+            elif next_fallback is not None and datetime.datetime.now() >= next_fallback:
+                self._submit('schedule', 'weekly fallback')
+                next_fallback = self._next_fallback()
+            elif wait == 0:
+                # Changes are due but a job is running; check again shortly
+                self._stopped.wait(1.0)
+
+    def _next_fallback(self) -> Optional[datetime.datetime]:
+        return next_fallback_run(self.fallback, datetime.datetime.now()) if self.fallback else None
+
+    def _submit(self, trigger: str, reason: str) -> None:
+        job, created = self.jobs.submit(self.folder_path, trigger=trigger)
+        self.triggered[trigger] += 1
+        logger.info(f"Training {'started' if created else 'joined'} ({reason}): job {job.id}")
+
+    def stats(self) -> Dict:
+        with self._condition:
+            pending = len(self._pending_paths)
+        return {
+            'mode': self.mode,
+            'debounce': self.debounce,
+            'pending_changes': pending,
+            'changes_seen': self.changes_seen,
+            'triggered': dict(self.triggered),
+            'watch_errors': self.watch_errors,
+            'next_fallback': self._next_fallback().isoformat() if self.fallback else None
+        }
@@ -0,0 +1,267 @@
+"""
+Background training jobs with stage progress and single-flight execution
+"""
+
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+from .locks import file_lock
+
+logger = logging.getLogger(__name__)
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Stages reported by train_chatbot, in the order they run
+TRAINING_STAGES = ['listing', 'downloading', 'extracting', 'embedding', 'indexing', 'writing']
+
+
+def _now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class TrainingJob:
+    """One training run: status, current stage and per-stage done/total counts."""
+
+    def __init__(self, folder_path: str, force: bool = False, trigger: str = 'api'):
+        self.id = uuid.uuid4().hex
+        self.folder_path = folder_path
+        self.force = force
+        self.trigger = trigger
+        self.status = 'queued'  # queued -> running -> succeeded | failed
+        self.stage = None
+        self.stages = {stage: {'done': None, 'total': None} for stage in TRAINING_STAGES}
+        self.result = None
+        self.error = None
+        self.created_at = _now()
+        self.started_at = None
+        self.finished_at = None
+        # Triggers that arrived while this job was queued or running
+        self.coalesced = 0
+        # Run in another worker process that this job waited for and took the result of
+        self.coalesced_into = None
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        # Called with the job after every change, e.g. to share its state with other processes
+        self.on_change: Optional[Callable[['TrainingJob'], None]] = None
+
+    def report(self, stage: str, done: Optional[int] = None, total: Optional[int] = None) -> None:
+        """Progress callback handed to train_chatbot."""
+        with self._lock:
+            self.stage = stage
+            progress = self.stages.setdefault(stage, {'done': None, 'total': None})
+            if done is not None:
+                progress['done'] = done
+            if total is not None:
+                progress['total'] = total
+        self._changed()
+
+    def _changed(self) -> None:
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'stage': self.stage,
+                'stages': {stage: dict(progress) for stage, progress in self.stages.items()},
+                'folder': self.folder_path,
+                'force': self.force,
+                'trigger': self.trigger,
+                'coalesced': self.coalesced,
+                'coalesced_into': self.coalesced_into,
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at
+            }
+
+
+class TrainingJobs:
+    """Runs train_fn on a background thread, at most one run at a time.
+
+    A trigger that arrives while a job is queued or running joins that job instead of
+    starting another, so the API, the scheduler and any retries never train concurrently.
+    With state_dir, runs are also serialized across worker processes by a file lock, and
+    job state is written there so any worker can report on any job. A job that waited for
+    another process's run takes that run's result instead of training again.
+    """
+
+    def __init__(self, train_fn: Callable, history: int = 50, state_dir: Optional[str] = None):
+        self.train_fn = train_fn
+        self.history = history
+        self.state_dir = state_dir
+        self._jobs: 'OrderedDict[str, TrainingJob]' = OrderedDict()
+        self._active: Optional[TrainingJob] = None
+        self._lock = threading.Lock()
+        if state_dir:
+            os.makedirs(os.path.join(state_dir, 'jobs'), exist_ok=True)
+
+    def submit(self, folder_path: str, force: bool = False, trigger: str = 'api') -> Tuple[TrainingJob, bool]:
+        """Start a job, or return the active one; the flag is True when a new job was created."""
+        with self._lock:
+            if self._active is not None:
+                self._active.coalesced += 1
+                return self._active, False
+            job = TrainingJob(folder_path, force, trigger)
+            self._active = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+        if self.state_dir:
+            job.on_change = self._save
+            self._save(job)
+            self._prune_saved()
+        threading.Thread(target=self._run, args=(job,), name=f"training-{job.id[:8]}", daemon=True).start()
+        return job, True
+
+    def run(self, folder_path: str, force: bool = False, trigger: str = 'scheduler') -> TrainingJob:
+        """Submit (or join) a job and block until it finishes."""
+        job, _ = self.submit(folder_path, force, trigger)
+        job.wait()
+        return job
+
+    def _run(self, job: TrainingJob) -> None:
+        try:
+            with self._process_lock(job) as waited:
+                other = self._finished_while_waiting(job) if waited else None
+                with job._lock:
+                    job.status = 'running'
+                    job.started_at = _now()
+                job._changed()
+                if other is not None:
+                    # Another worker trained while this job waited; running again would only repeat it
+                    logger.info(f"Training job {job.id} joined job {other['id']} of another process")
+                    job.coalesced_into = other['id']
+                    result = other.get('result')
+                else:
+                    logger.info(f"Training job {job.id} started ({job.trigger})")
+                    result = self.train_fn(job.folder_path, force=job.force, progress=job.report)
+        except Exception as e:
+            logger.exception(f"Training job {job.id} failed")
+            with job._lock:
+                job.status = 'failed'
+                job.error = str(e)
+        else:
+            with job._lock:
+                job.status = 'succeeded'
+                job.result = result
+            logger.info(f"Training job {job.id} finished")
+        finally:
+            with job._lock:
+                job.finished_at = _now()
+            with self._lock:
+                if self._active is job:
+                    self._active = None
+            job._changed()
+            job._finished.set()
+
+    @contextmanager
+    def _process_lock(self, job: TrainingJob):
+        """Wait for any run in another worker process to finish; yields whether it had to wait."""
+        if not self.state_dir:
+            yield False
+            return
+        lock_path = os.path.join(self.state_dir, 'training.lock')
+        with file_lock(lock_path, blocking=False) as acquired:
+            if acquired:
+                yield False
+                return
+        logger.info(f"Training job {job.id} waiting for a run in another process")
+        with file_lock(lock_path):
+            yield True
+
+    def _finished_while_waiting(self, job: TrainingJob) -> Optional[Dict]:
+        """The latest successful run of another process that finished after this job was created.
+
+        Like a trigger joining the active job in one process. Change-triggered jobs only
+        join runs that started after them, since an earlier run may have listed the
+        folder before the change.
+        """
+        latest = None
+        for path in glob.glob(os.path.join(self.state_dir, 'jobs', '*.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    other = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if other.get('id') == job.id or other.get('status') != 'succeeded' or other.get('coalesced_into'):
+                continue
+            if (other.get('finished_at') or '') < job.created_at:
+                continue
+            if job.trigger == 'change' and (other.get('started_at') or '') < job.created_at:
+                continue
+            if latest is None or other['finished_at'] > latest['finished_at']:
+                latest = other
+        return latest
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, 'jobs', f"{job_id}.json")
+
+    def _save(self, job: TrainingJob) -> None:
+        path = self._job_path(job.id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(job.to_dict(), f, default=str)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not save state of training job {job.id}: {e}")
+
+    def _prune_saved(self) -> None:
+        paths = sorted(glob.glob(os.path.join(self.state_dir, 'jobs', '*.json')), key=os.path.getmtime)
+        for path in paths[:-self.history]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, job_id: str) -> Optional[TrainingJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """State of a job started by this process or, with state_dir, by any other worker."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if not self.state_dir or not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @property
+    def active(self) -> Optional[TrainingJob]:
+        return self._active
+
+    def stats(self) -> Dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+            active = self._active
+        last = next((job for job in reversed(jobs) if job.finished), None)
+        return {
+            'active_job': active.id if active else None,
+            'last_job': last.id if last else None,
+            'last_status': last.status if last else None,
+            'jobs_tracked': len(jobs)
+        }
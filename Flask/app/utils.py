@@ -5,10 +5,9 @@ Utility functions for NLP processing and similarity matching
 import re
 from typing import List, Dict, Tuple
 import spacy
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-import torch
+from .embeddings import encode_sentences, encode_query
+from .retrieval import EmbeddingIndex, HybridScorer
 
 def clean_text(text: str) -> str:
    
@@ -22,7 +21,12 @@ def extract_key_phrases(text: str, nlp_model) -> List[str]:
     """
     Extract key phrases from text using spaCy
     """
-    doc = nlp_model(text)
+    return key_phrases_from_doc(nlp_model(text))
+
+def key_phrases_from_doc(doc) -> List[str]:
+    """
+    Extract key phrases from an already parsed spaCy doc
+    """
     key_phrases = []
     
     for chunk in doc.noun_chunks:
@@ -37,35 +41,19 @@ def extract_key_phrases(text: str, nlp_model) -> List[str]:
 
 
 def calculate_semantic_similarity(text1: str, text2: str, sbert_model) -> float:
-    embeddings = sbert_model.encode([text1, text2], convert_to_tensor=True)
-    return float(torch.nn.functional.cosine_similarity(embeddings[0], embeddings[1], dim=0).item())
+    # Both encodes go through the query embedding cache; vectors are already normalized
+    return float(np.dot(encode_query(sbert_model, text1), encode_query(sbert_model, text2)))
 
-def find_most_similar_sentences(query: str, sentences: List[str], sbert_model, top_k: int = 5) -> List[Tuple[str, float]]:
+def find_most_similar_sentences(query: str, sentences: List[str], sbert_model, top_k: int = 5, sentence_embeddings: np.ndarray = None,
+                                semantic_weight: float = 0.6, lexical_weight: float = 0.4) -> List[Tuple[str, float]]:
     
     if not sentences:
         return []
     
-    similarities = []
-    
-    for sentence in sentences:
-        # Semantic similarity
-        semantic_sim = calculate_semantic_similarity(query, sentence, sbert_model)
-        
-        # TF-IDF similarity
-        try:
-            vectorizer = TfidfVectorizer(stop_words='english', ngram_range=(1, 2))
-            tfidf_matrix = vectorizer.fit_transform([query.lower(), sentence.lower()])
-            tfidf_sim = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:2])[0][0]
-        except:
-            tfidf_sim = 0.0
-        
-        # Combined score
-        combined_score = (semantic_sim * 0.6) + (tfidf_sim * 0.4)
-        similarities.append((sentence, combined_score))
-    
-    # Sort by similarity and return top k
-    similarities.sort(key=lambda x: x[1], reverse=True)
-    return similarities[:top_k]
+    if sentence_embeddings is None:
+        sentence_embeddings = encode_sentences(sbert_model, sentences)
+    scorer = HybridScorer(EmbeddingIndex(sentences, sentence_embeddings), semantic_weight, lexical_weight)
+    return scorer.top_k(query, encode_query(sbert_model, query), top_k)
 
 def categorize_transaction_question(question: str) -> Dict[str, float]:
     
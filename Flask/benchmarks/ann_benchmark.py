@@ -0,0 +1,63 @@
+"""
+Exact vs IVF semantic search latency and recall as the condition corpus grows.
+
+    python benchmarks/ann_benchmark.py [--sizes 2000,20000,100000] [--nprobe 4,8,16] [--queries 200]
+
+Uses synthetic clustered embeddings of the SBERT dimension, so no model or database is
+needed; recall is the share of the exact top 10 found among the probed candidates.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from app.retrieval import IVFIndex, normalize_rows, top_k_indices
+
+
+def synthetic_embeddings(n, dim, clusters, rng):
+    centers = rng.normal(size=(clusters, dim))
+    rows = centers[rng.integers(0, clusters, n)] + rng.normal(scale=1.5, size=(n, dim))
+    return normalize_rows(rows.astype(np.float32))
+
+
+def search_latency(search, queries):
+    start = time.perf_counter()
+    for query in queries:
+        search(query)
+    return 1000 * (time.perf_counter() - start) / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='2000,20000,100000')
+    parser.add_argument('--nprobe', default='4,8,16')
+    parser.add_argument('--nlist', type=int, default=None)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>8} {'nlist':>6} {'build s':>8} {'exact ms':>9} {'nprobe':>7} {'ivf ms':>7} {'recall@10':>10}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        embeddings = synthetic_embeddings(size, args.dim, max(10, size // 500), rng)
+        queries = normalize_rows(embeddings[rng.choice(size, args.queries)]
+                                 + rng.normal(scale=0.02, size=(args.queries, args.dim)).astype(np.float32))
+        start = time.perf_counter()
+        ivf = IVFIndex.build(embeddings, args.nlist)
+        build = time.perf_counter() - start
+        exact = search_latency(lambda q: top_k_indices(embeddings @ q, 10), queries)
+        for nprobe in (int(p) for p in args.nprobe.split(',')):
+            def ivf_search(q):
+                rows = ivf.candidates(q, nprobe)
+                return rows[top_k_indices(embeddings[rows] @ q, 10)]
+            latency = search_latency(ivf_search, queries)
+            recall = ivf.measure_recall(embeddings, nprobe, queries=args.queries)
+            print(f"{size:>8} {ivf.nlist:>6} {build:>8.2f} {exact:>9.3f} {nprobe:>7} {latency:>7.3f} {recall:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
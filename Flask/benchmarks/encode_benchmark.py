@@ -0,0 +1,95 @@
+"""
+Compare SBERT encoding in input order with length-bucketed, truncated batches.
+
+    python benchmarks/encode_benchmark.py [--data-dir app/training_data] [--long 500] [--repeat 3]
+
+Sentences come from the bundled training_data files plus synthetic long inputs (joined
+runs of those sentences, like scraped pages or uploaded PDFs without punctuation), shuffled
+together. Both paths run with the same max_seq_length, so the embeddings should match.
+"""
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from app.embeddings import _encode_batches, configure_model, length_buckets, token_lengths
+from app.extraction import extract_text, load_segmenter, segment_texts
+
+
+def input_order(model, sentences, batch_size):
+    """The previous path: fixed chunks of batch_size in the order the sentences arrived."""
+    return np.vstack([
+        model.encode(sentences[start:start + batch_size], batch_size=batch_size, convert_to_numpy=True,
+                     normalize_embeddings=True, show_progress_bar=False)
+        for start in range(0, len(sentences), batch_size)
+    ])
+
+
+def padding_efficiency(lengths, batches):
+    padded = sum(int(lengths[rows].max()) * len(rows) for rows in batches)
+    return int(lengths.sum()) / padded
+
+
+def time_run(run, repeat):
+    best, output = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(__file__), '..', 'app', 'training_data'))
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--long', type=int, default=500, help='synthetic long inputs to add')
+    parser.add_argument('--long-words', type=int, default=300)
+    parser.add_argument('--max-seq-length', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.data_dir, '*')))
+    texts = [text for text in (extract_text(f) for f in files) if text]
+    sentences = sorted({s for doc in segment_texts(texts, load_segmenter('sentencizer')) for s in doc})
+    rng = random.Random(0)
+    long_inputs = []
+    for _ in range(args.long):
+        words = []
+        while len(words) < args.long_words:
+            words.extend(rng.choice(sentences).rstrip('.').split())
+        long_inputs.append(' '.join(words[:args.long_words]))
+    inputs = sentences + long_inputs
+    rng.shuffle(inputs)
+
+    model = SentenceTransformer(args.model)
+    configure_model(model, args.max_seq_length)
+    lengths = token_lengths(model, inputs)
+    order = np.argsort(lengths, kind='stable')
+    print(f"{len(sentences)} training sentences + {len(long_inputs)} long inputs, "
+          f"max_seq_length {model.max_seq_length}, {int((lengths >= model.max_seq_length).sum())} truncated\n")
+
+    fixed = [np.arange(start, min(start + args.batch_size, len(inputs))) for start in range(0, len(inputs), args.batch_size)]
+    bucketed = [order[bucket] for bucket in length_buckets(lengths[order], args.batch_size)]
+    baseline_time, baseline = time_run(lambda: input_order(model, inputs, args.batch_size), args.repeat)
+    bucketed_time, result = time_run(lambda: _encode_batches(model, inputs, args.batch_size, lengths), args.repeat)
+
+    print(f"{'path':<22}{'best (s)':>10}{'inputs/s':>10}{'batches':>9}{'padding eff':>13}{'speedup':>9}")
+    print(f"{'input order':<22}{baseline_time:>10.3f}{len(inputs) / baseline_time:>10.1f}{len(fixed):>9}"
+          f"{padding_efficiency(lengths, fixed):>13.3f}{1.0:>9.1f}")
+    print(f"{'length buckets':<22}{bucketed_time:>10.3f}{len(inputs) / bucketed_time:>10.1f}{len(bucketed):>9}"
+          f"{padding_efficiency(lengths, bucketed):>13.3f}{baseline_time / bucketed_time:>9.1f}")
+    print(f"\nmax |difference| between the two paths: {float(np.abs(baseline - result).max()):.2e}")
+
+
+if __name__ == '__main__':
+    main()
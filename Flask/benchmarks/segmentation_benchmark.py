@@ -0,0 +1,96 @@
+"""
+Compare training-time sentence segmentation paths on the bundled training_data files.
+
+    python benchmarks/segmentation_benchmark.py [--data-dir app/training_data] [--repeat 3]
+
+Text extraction happens once up front and is not timed; only segmentation and
+filtering are measured.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import spacy
+from app.extraction import extract_text, filter_sentences, load_segmenter, segment_texts
+
+
+def full_pipeline_per_document(texts, model_name):
+    """The original path: the complete pipeline plus sentencizer, called once per document."""
+    nlp = spacy.load(model_name)
+    nlp.add_pipe("sentencizer")
+
+    def run():
+        return [filter_sentences(sent.text for sent in nlp(text).sents) for text in texts]
+    return run
+
+
+def trimmed_pipe(texts, mode, model_name, batch_size, n_process):
+    nlp = load_segmenter(mode, model_name)
+
+    def run():
+        return segment_texts(texts, nlp, batch_size=batch_size, n_process=n_process)
+    return run
+
+
+def time_run(run, repeat):
+    best, output = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+def overlap(reference, candidate):
+    ref = {s for doc in reference for s in doc}
+    cand = {s for doc in candidate for s in doc}
+    return len(ref & cand) / len(ref | cand) if ref | cand else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(__file__), '..', 'app', 'training_data'))
+    parser.add_argument('--model', default='en_core_web_md')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--n-process', type=int, default=1)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.data_dir, '*')))
+    texts = [text for text in (extract_text(f) for f in files) if text]
+    print(f"{len(texts)} documents, {sum(len(t) for t in texts)} characters from {args.data_dir}\n")
+
+    candidates = [('sentencizer pipe', lambda: trimmed_pipe(texts, 'sentencizer', args.model, args.batch_size, args.n_process))]
+    try:
+        reference_run = full_pipeline_per_document(texts, args.model)
+        candidates.append(('senter pipe', lambda: trimmed_pipe(texts, 'senter', args.model, args.batch_size, args.n_process)))
+    except OSError as e:
+        print(f"Model {args.model} is not installed ({e}); timing the trimmed sentencizer path only.\n")
+        reference_run = None
+
+    reference = None
+    print(f"{'path':<28}{'best (s)':>10}{'docs/s':>10}{'sentences':>11}{'overlap':>9}{'speedup':>9}")
+    if reference_run is not None:
+        ref_time, reference = time_run(reference_run, args.repeat)
+        print(f"{'full pipeline per doc':<28}{ref_time:>10.3f}{len(texts) / ref_time:>10.1f}"
+              f"{sum(map(len, reference)):>11}{1.0:>9.2f}{1.0:>9.1f}")
+    for name, build in candidates:
+        try:
+            elapsed, output = time_run(build(), args.repeat)
+        except (OSError, ValueError) as e:
+            print(f"{name:<28} skipped: {e}")
+            continue
+        agreement = overlap(reference, output) if reference else float('nan')
+        speedup = ref_time / elapsed if reference else float('nan')
+        print(f"{name:<28}{elapsed:>10.3f}{len(texts) / elapsed:>10.1f}"
+              f"{sum(map(len, output)):>11}{agreement:>9.2f}{speedup:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
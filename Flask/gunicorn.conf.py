@@ -0,0 +1,70 @@
+"""
+Production launcher settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+The master imports the app and loads the SBERT and spaCy models once (preload_app),
+then forks the workers, which share those memory pages copy-on-write. Each worker gets
+its own slice of the CPU for torch, and exactly one of them runs the training scheduler.
+"""
+
+import gc
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+
+CPU_COUNT = multiprocessing.cpu_count()
+
+bind = os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '5050')}")
+# Several workers with a few torch threads each use a 16-core box better than one large pool
+workers = int(os.getenv('WEB_CONCURRENCY', str(max(2, CPU_COUNT // 4))))
+# Request threads per worker; most of a request's time outside inference is spent waiting on MongoDB and web pages
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+# Torch intra-op threads per worker, so that workers together use each core once
+TORCH_THREADS = int(os.getenv('TORCH_THREADS_PER_WORKER', str(max(1, CPU_COUNT // workers))))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+preload_app = True
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+loglevel = os.getenv('LOG_LEVEL', 'info')
+
+# Set before the master imports torch, so the master and every forked worker use the same limits;
+# app/inference.py splits the per-worker budget between concurrent encodes
+os.environ.setdefault('TORCH_THREADS_PER_WORKER', str(TORCH_THREADS))
+for variable in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+    os.environ.setdefault(variable, str(TORCH_THREADS))
+# Hugging Face tokenizers must not start their thread pool before the fork
+os.environ.setdefault('TOKENIZERS_PARALLELISM', 'false')
+
+# Loaded in the master and shared with the workers; clients with sockets (MongoDB, Dropbox) are not fork-safe
+PRELOAD_RESOURCES = [name for name in os.getenv('PRELOAD_RESOURCES', 'sbert_model,nlp,type_labels').split(',') if name]
+
+
+def when_ready(server):
+    from app.resources import warmup
+    report = warmup(PRELOAD_RESOURCES)
+    for step in report['steps']:
+        server.log.info(f"startup {step['step']}: {step['seconds']:.2f}s")
+    # Objects that exist now are never written by the garbage collector, keeping their pages shared
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if 'torch' in sys.modules:
+        from app.inference import configure_threads
+        configure_threads()
+
+
+def post_worker_init(worker):
+    from app.resources import warmup
+    from app.routes import start_training_scheduler
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    # MongoDB and Dropbox clients are created per worker; the preloaded models are already there
+    threading.Thread(target=warmup, name='warmup', daemon=True).start()
+    if os.getenv('TRAINING_SCHEDULER', '1') == '1':
+        # Every worker competes for the scheduler lock; one wins, another takes over if it exits
+        start_training_scheduler(worker.wsgi.config['TRAINING_FOLDER'])
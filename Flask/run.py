@@ -1,10 +1,8 @@
 from app import create_app
-from threading import Thread
-from app.routes import train_chatbot
-import time
-import threading
+from app.resources import warmup
 import logging 
-import datetime
+import os
+import threading
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -14,30 +12,22 @@ app = create_app()
 
 app.config['TRAINING_FOLDER'] = '/chatbot-training'
 
+# Development server only; production runs gunicorn -c gunicorn.conf.py wsgi:app
+DEBUG = os.getenv('FLASK_DEBUG', '1') == '1'
 
 
+def start_background_services():
+    # create_app() has imported (and timed) app.routes by now
+    from app.routes import start_training_scheduler
+    # Load models and clients in the background so the server starts answering immediately
+    if os.getenv('WARMUP_ON_START', '1') == '1':
+        threading.Thread(target=warmup, name='warmup', daemon=True).start()
+    # Retrain when the Dropbox folder changes; the weekly Monday 09:00 run remains as a fallback
+    start_training_scheduler(app.config['TRAINING_FOLDER'])
 
-def periodic_training():
-    def loop():
-        while True:
-            now = datetime.datetime.now()
-            # Monday is 0 (0=Monday, 6=Sunday)
-            if now.weekday() == 0 and now.hour == 9 and now.minute == 0:
-                try:
-                    logging.info("Starting training...")
-                    train_chatbot(app.config['TRAINING_FOLDER'])
-                    logging.info("Training completed.")
-                except Exception as e:
-                    logging.error(f"Training failed: {e}")
-                # Sleep 61s to avoid running multiple times within the same minute
-                time.sleep(61)
-            else:
-                # Check every 30 seconds
-                time.sleep(30)
-
-    threading.Thread(target=loop, daemon=True).start()
 
-# Start background training loop
-periodic_training()
 if __name__ == "__main__":
-    app.run(host='0.0.0.0',debug=True, port=5050)
+    # With the reloader, only the child process that serves requests runs background services
+    if not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    app.run(host='0.0.0.0',debug=DEBUG, port=5050)
@@ -0,0 +1,30 @@
+"""
+Shared fixtures: a deterministic stand-in for the SBERT model
+"""
+
+import zlib
+
+import numpy as np
+import pytest
+
+
+class FakeModel:
+    """Encodes each text to a fixed random unit vector and records every text it was asked for."""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+        self.encoded = []
+
+    def vector(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode('utf-8'))).normal(size=self.dim)
+        return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, normalize_embeddings=True,
+               show_progress_bar=False):
+        self.encoded.extend(sentences)
+        return np.array([self.vector(s) for s in sentences], dtype=np.float32).reshape(len(sentences), self.dim)
+
+
+@pytest.fixture
+def sbert_model():
+    return FakeModel()
@@ -0,0 +1,87 @@
+"""
+Request-path caches, with a manual clock for expiry
+
+    python -m pytest tests
+"""
+
+from app.cache import LRUCache, ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert len(cache) == 2
+
+
+def test_entries_expire_after_ttl():
+    clock = Clock()
+    cache = LRUCache(maxsize=8, ttl=10, clock=clock)
+    cache.put('a', 1)
+
+    clock.now = 9.9
+    assert cache.get('a') == 1
+    clock.now = 10.0
+    assert cache.get('a', 'gone') == 'gone'
+    assert len(cache) == 0
+
+
+def test_get_or_compute_computes_once_and_counts_hits():
+    cache = LRUCache(maxsize=8)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return 'value'
+
+    assert cache.get_or_compute('key', compute) == 'value'
+    assert cache.get_or_compute('key', compute) == 'value'
+
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = LRUCache(maxsize=0)
+    cache.put('a', 1)
+
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_response_cache_serves_answers_of_the_current_corpus_version():
+    cache = ResponseCache()
+    assert cache.lookup('Who pays?', 1) is None
+    cache.store('Who pays?', 1, {'answer': 'The buyer.'})
+
+    assert cache.lookup('Who pays?', 1) == {'answer': 'The buyer.'}
+    assert cache.lookup('Who repairs?', 1) is None
+
+
+def test_response_cache_drops_answers_when_the_corpus_version_moves_on():
+    cache = ResponseCache()
+    cache.lookup('Who pays?', 1)
+    cache.store('Who pays?', 1, {'answer': 'The buyer.'})
+
+    assert cache.lookup('Who pays?', 2) is None
+    assert len(cache) == 0
+    # A request still running on the old version neither reads nor repopulates the cache
+    cache.store('Who pays?', 1, {'answer': 'The buyer.'})
+    assert cache.lookup('Who pays?', 1) is None
+    assert len(cache) == 0
+    assert cache.stats()['corpus_version'] == 2
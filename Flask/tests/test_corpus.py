@@ -0,0 +1,153 @@
+"""
+Blue/green corpus versions in MongoDB, run against mongomock
+
+    python -m pytest tests
+"""
+
+import mongomock
+import numpy as np
+import pytest
+
+from app.corpus import CorpusStore
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().chatbot.conditions
+
+
+def open_store(collection, sbert_model, **kwargs):
+    # check_interval=0: every read sees the latest pointer, like another worker would after its interval
+    return CorpusStore(collection, sbert_model, 'fake-model', check_interval=0, **kwargs)
+
+
+def train(store, corpora):
+    version = store.begin_version()
+    indexes = {t_type: store.build_index(sentences) for t_type, sentences in corpora.items()}
+    store.write_version(version, indexes)
+    return version, indexes
+
+
+SALE_V1 = ['The buyer pays a deposit.', 'The seller signs the deed.']
+SALE_V2 = ['The buyer pays a deposit.', 'The notary registers the sale.']
+LEASE = ['The tenant pays rent monthly.']
+
+
+def test_written_version_is_served_only_once_activated(collection, sbert_model):
+    writer = open_store(collection, sbert_model)
+    reader = open_store(collection, sbert_model)
+
+    version, _ = train(writer, {'sale': SALE_V1, 'lease': LEASE})
+    assert reader.get('sale') is None
+
+    writer.activate(version)
+
+    assert sorted(reader.get('sale').sentences) == sorted(SALE_V1)
+    assert reader.get('lease').sentences == LEASE
+    assert reader.transaction_types() == ['lease', 'sale']
+    assert writer.versions()['active_version'] == version
+    assert writer.versions()['versions'] == [{'version': version, 'transaction_types': ['lease', 'sale']}]
+
+
+def test_readers_keep_the_active_version_while_the_next_one_is_written(collection, sbert_model):
+    writer = open_store(collection, sbert_model)
+    reader = open_store(collection, sbert_model)
+    first, _ = train(writer, {'sale': SALE_V1})
+    writer.activate(first)
+
+    second, indexes = train(writer, {'sale': SALE_V2})
+    assert sorted(reader.get('sale').sentences) == sorted(SALE_V1)
+
+    writer.activate(second, indexes)
+    assert sorted(reader.get('sale').sentences) == sorted(SALE_V2)
+    # The writer serves what it just wrote without reading it back
+    assert writer.get('sale') is indexes['sale']
+
+
+def test_stored_embeddings_are_served_without_encoding_again(collection, sbert_model):
+    writer = open_store(collection, sbert_model)
+    version, indexes = train(writer, {'sale': SALE_V1})
+    writer.activate(version)
+    sbert_model.encoded.clear()
+
+    index = open_store(collection, sbert_model).get('sale')
+
+    assert sbert_model.encoded == []
+    rows = {sentence: row for row, sentence in enumerate(index.sentences)}
+    for row, sentence in enumerate(indexes['sale'].sentences):
+        assert np.allclose(index.embeddings[rows[sentence]], indexes['sale'].embeddings[row])
+
+
+def test_unchanged_sentences_only_gain_the_version(collection, sbert_model, monkeypatch):
+    writer = open_store(collection, sbert_model)
+    first, _ = train(writer, {'sale': SALE_V1})
+    writer.activate(first)
+    written = []
+    bulk_write = writer.sentences.bulk_write
+
+    def recording_bulk_write(requests, **kwargs):
+        written.extend(requests)
+        return bulk_write(requests, **kwargs)
+
+    monkeypatch.setattr(writer.sentences, 'bulk_write', recording_bulk_write)
+
+    second, _ = train(writer, {'sale': SALE_V2})
+
+    assert len(written) == 1
+    versions = {doc['text']: doc['versions'] for doc in writer.sentences.find()}
+    assert versions == {
+        'The buyer pays a deposit.': [first, second],
+        'The seller signs the deed.': [first],
+        'The notary registers the sale.': [second]
+    }
+    writer.activate(second)
+    assert sorted(open_store(collection, sbert_model).get('sale').sentences) == sorted(SALE_V2)
+
+
+def test_rollback_serves_the_previous_version(collection, sbert_model):
+    writer = open_store(collection, sbert_model)
+    reader = open_store(collection, sbert_model)
+    first, _ = train(writer, {'sale': SALE_V1})
+    writer.activate(first)
+    second, _ = train(writer, {'sale': SALE_V2})
+    writer.activate(second)
+
+    writer.rollback()
+
+    assert writer.versions()['active_version'] == first
+    assert sorted(reader.get('sale').sentences) == sorted(SALE_V1)
+    with pytest.raises(ValueError):
+        writer.rollback()
+    writer.rollback(second)
+    assert sorted(reader.get('sale').sentences) == sorted(SALE_V2)
+
+
+def test_versions_beyond_the_retention_window_are_pruned(collection, sbert_model):
+    writer = open_store(collection, sbert_model, keep_versions=2)
+    versions = []
+    for corpus in (SALE_V1, SALE_V2, LEASE):
+        version, _ = train(writer, {'sale': corpus})
+        writer.activate(version)
+        versions.append(version)
+
+    assert [v['version'] for v in writer.versions()['versions']] == versions[1:]
+    with pytest.raises(ValueError):
+        writer.rollback(versions[0])
+    writer.rollback()
+    assert sorted(open_store(collection, sbert_model).get('sale').sentences) == sorted(SALE_V2)
+
+
+def test_ivf_centroids_are_stored_with_the_version(collection, sbert_model):
+    writer = open_store(collection, sbert_model, ann_threshold=50, ann_nlist=4)
+    version = writer.begin_version()
+    index = writer.build_index([f"Condition number {i} of the sale." for i in range(60)])
+    writer.build_ann(index)
+    writer.write_version(version, {'sale': index})
+    writer.activate(version)
+
+    # A reader configured for more lists still uses the stored ones instead of training its own
+    loaded = open_store(collection, sbert_model, ann_threshold=50, ann_nlist=8).get('sale')
+
+    assert loaded.ann.nlist == 4
+    assert np.allclose(loaded.ann.centroids, index.ann.centroids)
+    assert loaded.ann.recall == index.ann.recall
@@ -0,0 +1,176 @@
+"""
+Training mirror against LocalDropboxClient, without Dropbox credentials
+
+    python -m pytest tests
+"""
+
+import os
+
+import pytest
+import requests
+
+from app.dropbox_sync import DropboxMirror
+from app.local_dropbox import LocalDropboxClient, LocalResponse
+
+FOLDER = '/chatbot-training'
+
+
+def write(directory, name, text):
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    # Bump the mtime so a rewrite within the same clock tick still gets a new rev
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    return path
+
+
+class InterruptedDropboxClient(LocalDropboxClient):
+    """Streams the first chunk of every download, then drops the connection."""
+
+    def files_download(self, path):
+        metadata, response = super().files_download(path)
+
+        def interrupted(chunk_size=1024 * 1024):
+            yield next(LocalResponse.iter_content(response, chunk_size))
+            raise requests.exceptions.ChunkedEncodingError('connection dropped')
+
+        response.iter_content = interrupted
+        return metadata, response
+
+
+@pytest.fixture
+def source(tmp_path):
+    directory = tmp_path / 'dropbox'
+    directory.mkdir()
+    return str(directory)
+
+
+@pytest.fixture
+def mirror_dir(tmp_path):
+    return str(tmp_path / 'mirror')
+
+
+def test_sync_follows_pagination(source, mirror_dir):
+    for i in range(7):
+        write(source, f"doc{i}.txt", f"Condition number {i}.")
+    mirror = DropboxMirror(LocalDropboxClient(source, FOLDER, page_size=2), mirror_dir)
+
+    result = mirror.sync(FOLDER)
+
+    assert sorted(result.changed) == [f"{FOLDER}/doc{i}.txt" for i in range(7)]
+    assert sorted(os.listdir(mirror.files_dir)) == [f"doc{i}.txt" for i in range(7)]
+
+
+def test_sync_retries_transient_download_failures(source, mirror_dir):
+    write(source, 'terms.txt', 'The buyer pays the deposit.')
+    mirror = DropboxMirror(LocalDropboxClient(source, FOLDER, transient_failures=1), mirror_dir)
+
+    result = mirror.sync(FOLDER)
+
+    assert result.changed == [f"{FOLDER}/terms.txt"]
+    [download] = result.downloads
+    assert download.error is None
+    assert download.attempts == 2
+
+
+def test_interrupted_download_leaves_no_partial_file(source, mirror_dir):
+    write(source, 'terms.txt', 'The buyer pays the deposit. ' * 100)
+    mirror = DropboxMirror(InterruptedDropboxClient(source, FOLDER), mirror_dir, chunk_size=64, retries=1)
+
+    result = mirror.sync(FOLDER)
+
+    [download] = result.downloads
+    assert download.error and download.attempts == 2
+    assert result.changed == []
+    assert os.listdir(mirror.files_dir) == []
+
+
+def test_sync_gives_up_after_retries_and_retries_next_sync(source, mirror_dir):
+    write(source, 'terms.txt', 'The buyer pays the deposit.')
+    client = LocalDropboxClient(source, FOLDER, transient_failures=2)
+    mirror = DropboxMirror(client, mirror_dir, retries=1)
+
+    failed = mirror.sync(FOLDER)
+    assert failed.changed == []
+    assert failed.downloads[0].error
+
+    assert mirror.sync(FOLDER).changed == [f"{FOLDER}/terms.txt"]
+
+
+def test_sync_forgets_deleted_files(source, mirror_dir):
+    write(source, 'keep.txt', 'Kept condition.')
+    removed = write(source, 'remove.txt', 'Removed condition.')
+    mirror = DropboxMirror(LocalDropboxClient(source, FOLDER), mirror_dir)
+    for path in mirror.sync(FOLDER).changed:
+        mirror.store_sentences(path, [path])
+
+    os.remove(removed)
+    result = mirror.sync(FOLDER)
+
+    assert result.deleted == [f"{FOLDER}/remove.txt"]
+    assert result.unchanged == [f"{FOLDER}/keep.txt"]
+    assert sorted(mirror.files) == [f"{FOLDER}/keep.txt"]
+    assert os.listdir(mirror.files_dir) == ['keep.txt']
+    # The removed file's cached sentences go with it
+    assert os.listdir(mirror.sentences_dir) == [mirror.files[f"{FOLDER}/keep.txt"]['sentences_file']]
+    # The deletion is persisted, so a fresh process sees it too
+    assert sorted(DropboxMirror(LocalDropboxClient(source, FOLDER), mirror_dir).files) == [f"{FOLDER}/keep.txt"]
+
+
+def test_failed_extraction_keeps_previous_version_until_it_recovers(source, mirror_dir):
+    path = f"{FOLDER}/terms.txt"
+    write(source, 'terms.txt', 'Old condition.')
+    mirror = DropboxMirror(LocalDropboxClient(source, FOLDER), mirror_dir)
+    mirror.sync(FOLDER)
+    mirror.store_sentences(path, ['Old condition.'])
+    trained = mirror.fingerprint()
+
+    write(source, 'terms.txt', 'New, longer condition.')
+    assert mirror.sync(FOLDER).changed == [path]
+    mirror.extraction_failed(path)
+    mirror.save_manifest()
+
+    # The last extracted version stays in the corpus and the file is retried next time
+    assert mirror.load_sentences(path) == ['Old condition.']
+    assert mirror.fingerprint() == trained
+    mirror = DropboxMirror(LocalDropboxClient(source, FOLDER), mirror_dir)
+    assert mirror.sync(FOLDER).changed == [path]
+
+    mirror.store_sentences(path, ['New, longer condition.'])
+    assert mirror.load_sentences(path) == ['New, longer condition.']
+    assert mirror.fingerprint() != trained
+    assert 'previous' not in mirror.files[path]
+    assert os.listdir(mirror.sentences_dir) == [mirror.files[path]['sentences_file']]
+
+
+def test_failed_extraction_of_new_file_drops_it_until_next_sync(source, mirror_dir):
+    path = f"{FOLDER}/new.txt"
+    write(source, 'new.txt', 'Unreadable for now.')
+    mirror = DropboxMirror(LocalDropboxClient(source, FOLDER), mirror_dir)
+    mirror.sync(FOLDER)
+
+    mirror.extraction_failed(path)
+
+    assert path not in mirror.files
+    assert os.listdir(mirror.files_dir) == []
+    assert mirror.sync(FOLDER).changed == [path]
+
+
+
+def test_changing_the_segmenter_extracts_every_file_again(source, mirror_dir):
+    path = f"{FOLDER}/terms.txt"
+    write(source, 'terms.txt', 'The buyer pays the deposit. The seller signs the deed.')
+    mirror = DropboxMirror(LocalDropboxClient(source, FOLDER), mirror_dir, segmenter='sentencizer')
+    mirror.sync(FOLDER)
+    mirror.store_sentences(path, ['The buyer pays the deposit.', 'The seller signs the deed.'])
+    mirror.save_manifest()
+    trained = mirror.fingerprint()
+
+    mirror = DropboxMirror(LocalDropboxClient(source, FOLDER), mirror_dir, segmenter='senter-en_core_web_md')
+    assert mirror.sync(FOLDER).changed == [path]
+    assert mirror.fingerprint() != trained
+
+    mirror.store_sentences(path, ['The buyer pays the deposit. The seller signs the deed.'])
+    assert os.listdir(mirror.sentences_dir) == [mirror.files[path]['sentences_file']]
+    assert mirror.sync(FOLDER).unchanged == [path]
@@ -0,0 +1,96 @@
+"""
+On-disk sentence-embedding cache
+
+    python -m pytest tests
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from app import embeddings
+from app.embedding_cache import EmbeddingCache, sentence_hash
+
+SENTENCES = ['The buyer pays a deposit.', 'The seller signs the deed.', 'The tenant pays rent.']
+
+
+def unit_rows(n, dim=8, seed=0):
+    rows = np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def test_rows_round_trip_through_float16(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'fake-model@256')
+    vectors = unit_rows(3)
+    hashes = [sentence_hash(s) for s in SENTENCES]
+
+    assert cache.put(hashes[:2], vectors[:2]) == 2
+    found, rows = cache.get(hashes)
+
+    assert found == [0, 1]
+    assert rows.dtype == np.float32
+    assert np.allclose(rows, vectors[:2], atol=1e-3)
+    assert np.allclose(np.linalg.norm(rows, axis=1), 1.0, atol=1e-6)
+    stats = cache.stats()
+    assert (stats['rows'], stats['hits'], stats['misses'], stats['writes']) == (2, 2, 1, 2)
+
+
+def test_cached_rows_are_not_written_again(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'fake-model@256')
+    hashes = [sentence_hash(s) for s in SENTENCES]
+    cache.put(hashes[:2], unit_rows(2))
+
+    assert cache.put(hashes, unit_rows(3, seed=1)) == 1
+    assert len(cache) == 3
+    assert os.path.getsize(cache.vectors_path) == 3 * 8 * 2
+
+
+def test_rows_written_by_another_process_are_picked_up(tmp_path):
+    reader = EmbeddingCache(str(tmp_path), 'fake-model@256')
+    writer = EmbeddingCache(str(tmp_path), 'fake-model@256')
+    hashes = [sentence_hash(s) for s in SENTENCES]
+    vectors = unit_rows(3)
+
+    writer.put(hashes, vectors)
+    found, rows = reader.get(hashes[::-1])
+
+    assert found == [0, 1, 2]
+    assert np.allclose(rows, vectors[::-1], atol=1e-3)
+
+
+def test_rows_left_without_keys_are_overwritten(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'fake-model@256')
+    hashes = [sentence_hash(s) for s in SENTENCES]
+    vectors = unit_rows(3)
+    cache.put(hashes[:1], vectors[:1])
+    # A writer that crashed after appending its rows but before their keys
+    with open(cache.vectors_path, 'ab') as f:
+        f.write(np.ones((2, 8), dtype=np.float16).tobytes())
+
+    cache.put(hashes[1:], vectors[1:])
+
+    _, rows = EmbeddingCache(str(tmp_path), 'fake-model@256').get(hashes)
+    assert np.allclose(rows, vectors, atol=1e-3)
+
+
+def test_dimension_mismatch_is_rejected(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'fake-model@256')
+    cache.put([sentence_hash(SENTENCES[0])], unit_rows(1))
+
+    with pytest.raises(ValueError):
+        cache.put([sentence_hash(SENTENCES[1])], unit_rows(1, dim=4))
+
+
+def test_encode_sentences_reuses_stored_embeddings(tmp_path, monkeypatch, sbert_model):
+    monkeypatch.setattr(embeddings, 'ENCODE_CACHE_DIR', str(tmp_path))
+    embeddings.set_model_name(sbert_model, 'fake-model')
+
+    first = embeddings.encode_sentences(sbert_model, SENTENCES[:2], store=True)
+    sbert_model.encoded.clear()
+    second = embeddings.encode_sentences(sbert_model, SENTENCES)
+
+    assert sbert_model.encoded == [SENTENCES[2]]
+    assert np.allclose(second[:2], first, atol=1e-3)
+    # Request-time encodes (store=False) do not grow the cache
+    assert len(embeddings.embedding_cache(sbert_model)) == 2
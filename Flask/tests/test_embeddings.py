@@ -0,0 +1,53 @@
+"""
+Encoding helpers, with a deterministic stand-in for the SBERT model
+
+    python -m pytest tests
+"""
+
+import numpy as np
+
+from app.embeddings import EmbeddingMemo, _encode_batches, length_buckets
+
+
+def test_memo_encodes_each_distinct_text_once(sbert_model):
+    memo = EmbeddingMemo(sbert_model)
+
+    first = memo.similarities('deposit', ['pays a deposit', 'pays rent', 'pays a deposit'])
+    second = memo.similarities('deposit', ['pays rent', 'repairs the roof'])
+
+    assert sorted(sbert_model.encoded) == ['deposit', 'pays a deposit', 'pays rent', 'repairs the roof']
+    assert np.isclose(first[0], first[2])
+    assert np.isclose(first[1], second[0])
+
+
+def test_memo_similarities_are_cosine_scores(sbert_model):
+    sentences = ['pays a deposit', 'pays rent']
+
+    scores = EmbeddingMemo(sbert_model).similarities('deposit', sentences)
+
+    expected = [float(sbert_model.vector(s) @ sbert_model.vector('deposit')) for s in sentences]
+    assert np.allclose(scores, expected, atol=1e-6)
+    assert len(EmbeddingMemo(sbert_model).similarities('deposit', [])) == 0
+
+
+def test_length_buckets_respect_batch_size_and_token_budget():
+    lengths = np.array([4] * 10 + [100] * 5 + [300])
+
+    buckets = length_buckets(lengths, batch_size=4, max_batch_tokens=256)
+
+    assert [lengths[b].tolist() for b in buckets] == [[4] * 4, [4] * 4, [4, 4], [100, 100], [100, 100], [100], [300]]
+    covered = [row for b in buckets for row in range(len(lengths))[b]]
+    assert covered == list(range(len(lengths)))
+    for b in buckets:
+        rows = lengths[b]
+        assert len(rows) <= 4
+        assert len(rows) == 1 or len(rows) * rows.max() <= 256
+
+
+def test_bucketed_encoding_returns_rows_in_input_order(sbert_model):
+    sentences = ['a long sentence about the deposit paid by the buyer on signing', 'short', 'a medium sentence']
+
+    result = _encode_batches(sbert_model, sentences, batch_size=2)
+
+    assert np.allclose(result, [sbert_model.vector(s) for s in sentences])
+    assert sbert_model.encoded[0] == 'short'
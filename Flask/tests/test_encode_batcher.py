@@ -0,0 +1,97 @@
+"""
+Cross-request micro-batching of encodes
+
+    python -m pytest tests
+"""
+
+import threading
+
+import numpy as np
+import pytest
+
+from app.encode_batcher import EncodeBatcher
+
+
+class RecordingEncoder:
+    """encode_fn that maps each text to a row derived from it and records every batch."""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    @staticmethod
+    def rows(texts):
+        return np.array([[len(text), sum(map(ord, text))] for text in texts], dtype=np.float32)
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        if self.fail:
+            raise RuntimeError('model unavailable')
+        return self.rows(texts)
+
+
+def encode_concurrently(batcher, requests):
+    results = [None] * len(requests)
+    errors = [None] * len(requests)
+    start = threading.Barrier(len(requests))
+
+    def run(i):
+        start.wait()
+        try:
+            results[i] = batcher.encode(requests[i])
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_concurrent_requests_share_a_batch_and_get_their_own_rows():
+    encoder = RecordingEncoder()
+    batcher = EncodeBatcher(encoder, max_wait=0.2, max_batch=32)
+    requests = [[f"question {i}", f"condition {i}"] for i in range(4)]
+
+    results, errors = encode_concurrently(batcher, requests)
+
+    assert errors == [None] * 4
+    assert len(encoder.batches) < len(requests)
+    for texts, result in zip(requests, results):
+        assert (result == encoder.rows(texts)).all()
+    stats = batcher.stats()
+    assert stats['requests'] == 4
+    assert stats['mean_requests_per_batch'] > 1
+
+
+def test_duplicate_texts_are_encoded_once():
+    encoder = RecordingEncoder()
+    batcher = EncodeBatcher(encoder, max_wait=0.2, max_batch=32)
+
+    results, _ = encode_concurrently(batcher, [['same question'], ['same question', 'other']])
+
+    assert sum(batch.count('same question') for batch in encoder.batches) == 1
+    assert (results[0][0] == results[1][0]).all()
+    assert batcher.stats()['duplicate_texts'] == 1
+
+
+def test_large_requests_are_not_merged():
+    encoder = RecordingEncoder()
+    batcher = EncodeBatcher(encoder, max_wait=0.05, max_batch=4)
+    texts = [f"condition {i}" for i in range(10)]
+
+    assert (batcher.encode(texts) == encoder.rows(texts)).all()
+    assert encoder.batches == [texts]
+
+
+def test_errors_reach_every_caller_in_the_batch():
+    batcher = EncodeBatcher(RecordingEncoder(fail=True), max_wait=0.2, max_batch=32)
+
+    results, errors = encode_concurrently(batcher, [['a'], ['b'], ['c']])
+
+    assert results == [None] * 3
+    assert all(isinstance(e, RuntimeError) for e in errors)
+    with pytest.raises(RuntimeError):
+        batcher.encode(['d'])
@@ -0,0 +1,30 @@
+"""
+File locks shared by worker processes
+
+    python -m pytest tests
+"""
+
+from app.locks import file_lock, flock_exclusive
+
+
+def test_busy_lock_is_not_taken_without_blocking(tmp_path):
+    path = str(tmp_path / 'write.lock')
+
+    with file_lock(path) as held:
+        # A second open file description conflicts like another process would
+        with file_lock(path, blocking=False) as acquired:
+            assert held and not acquired
+
+    with file_lock(path, blocking=False) as acquired:
+        assert acquired
+
+
+def test_lease_is_kept_until_the_file_is_closed(tmp_path):
+    path = str(tmp_path / 'leader.lock')
+    with open(path, 'a') as leader:
+        assert flock_exclusive(leader, blocking=False)
+        with open(path, 'a') as follower:
+            assert not flock_exclusive(follower, blocking=False)
+
+    with open(path, 'a') as follower:
+        assert flock_exclusive(follower, blocking=False)
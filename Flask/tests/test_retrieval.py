@@ -0,0 +1,181 @@
+"""
+Ranking of stored conditions, with synthetic embeddings instead of an SBERT model
+
+    python -m pytest tests
+"""
+
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+from app.retrieval import BM25Index, EmbeddingIndex, HybridScorer, IVFIndex, normalize_rows, top_k_indices
+
+CONDITIONS = [
+    'The buyer pays a deposit of ten percent on signing.',
+    'The seller keeps the deposit if the buyer withdraws.',
+    'The tenant pays rent on the first day of every month.',
+    'The landlord repairs the roof and the heating.',
+    'Either party may end the lease with three months notice.',
+]
+
+
+def clustered_embeddings(n, dim=32, clusters=40, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return normalize_rows((centers[rng.integers(0, clusters, n)] + rng.normal(scale=0.5, size=(n, dim))).astype(np.float32))
+
+
+def word_sentences(n, vocabulary=300, length=8, seed=0):
+    rng = np.random.default_rng(seed)
+    return [' '.join(f"term{w}" for w in rng.integers(0, vocabulary, length)) for _ in range(n)]
+
+
+def random_index(sentences, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    return EmbeddingIndex(sentences, rng.normal(size=(len(sentences), dim)))
+
+
+def test_top_k_indices_matches_a_full_sort():
+    scores = np.random.default_rng(0).normal(size=1000)
+
+    assert list(top_k_indices(scores, 10)) == list(np.argsort(-scores)[:10])
+    assert list(top_k_indices(scores[:3], 10)) == list(np.argsort(-scores[:3]))
+    assert len(top_k_indices(scores, 0)) == 0
+
+
+def test_embedding_index_normalizes_rows():
+    index = random_index(CONDITIONS)
+
+    assert np.allclose(np.linalg.norm(index.embeddings, axis=1), 1.0, atol=1e-6)
+    assert np.allclose(index.similarities(index.embeddings[2]), index.embeddings @ index.embeddings[2])
+
+
+def test_hybrid_scorer_ranks_the_semantic_match_first():
+    index = random_index(CONDITIONS)
+    scorer = HybridScorer(index, semantic_weight=1.0, lexical_weight=0.0)
+
+    [(sentence, score)] = scorer.top_k('anything', index.embeddings[3], top_k=1)
+
+    assert sentence == CONDITIONS[3]
+    assert score > 0.99
+
+
+def test_hybrid_scorer_ranks_the_lexical_match_first():
+    index = random_index(CONDITIONS)
+    scorer = HybridScorer(index, semantic_weight=0.0, lexical_weight=1.0)
+
+    ranked = scorer.top_k('When is the rent due each month?', normalize_rows(np.ones((1, index.dim)))[0], top_k=2)
+
+    assert ranked[0][0] == CONDITIONS[2]
+    assert ranked[0][1] > ranked[1][1]
+
+
+def test_hybrid_scorer_scores_match_weighted_sum():
+    index = random_index(CONDITIONS)
+    scorer = HybridScorer(index, semantic_weight=0.6, lexical_weight=0.4)
+    query, query_embedding = 'deposit paid by the buyer', index.embeddings[0]
+
+    expected = 0.6 * index.similarities(query_embedding) + 0.4 * scorer.lexical_scores(query)
+
+    assert np.allclose(scorer.scores(query, query_embedding), expected)
+    assert [s for s, _ in scorer.top_k(query, query_embedding, top_k=5)] == [
+        CONDITIONS[i] for i in np.argsort(-expected, kind='stable')
+    ]
+
+
+def test_hybrid_scorer_without_vocabulary_falls_back_to_semantic_scores():
+    index = random_index(['the', 'and the', 'of'])
+    scorer = HybridScorer(index)
+
+    assert not scorer.lexical_scores('the').any()
+    assert scorer.top_k('the', index.embeddings[1], top_k=1)[0][0] == 'and the'
+
+
+def test_ivf_lists_partition_the_corpus():
+    embeddings = clustered_embeddings(2000)
+    ivf = IVFIndex.build(embeddings, nlist=32)
+
+    assert ivf.nlist == 32
+    assert sorted(ivf.candidates(embeddings[0], ivf.nlist)) == list(range(2000))
+    assert len(ivf.candidates(embeddings[0], 1)) < 2000
+
+
+def test_ivf_recall_on_clustered_embeddings():
+    embeddings = clustered_embeddings(2000)
+    ivf = IVFIndex.build(embeddings, nlist=32)
+
+    assert ivf.measure_recall(embeddings, nprobe=8) >= 0.9
+    assert ivf.recall_nprobe == 8
+    assert ivf.measure_recall(embeddings, nprobe=ivf.nlist) == 1.0
+    # A row is listed under its nearest centroid, the first list its own embedding probes
+    for row in (0, 500, 1999):
+        assert row in ivf.candidates(embeddings[row], 1)
+
+
+def test_ivf_rebuilt_from_centroids_keeps_its_lists():
+    embeddings = clustered_embeddings(2000)
+    ivf = IVFIndex.build(embeddings, nlist=32)
+
+    rebuilt = IVFIndex.from_centroids(ivf.centroids, embeddings)
+
+    assert (rebuilt.assignments == ivf.assignments).all()
+
+
+def test_hybrid_scorer_searches_only_the_probed_lists():
+    embeddings = clustered_embeddings(2000)
+    sentences = [f"condition {i}" for i in range(len(embeddings))]
+    index = EmbeddingIndex(sentences, embeddings, ann=IVFIndex.build(embeddings, nlist=32))
+    scorer = HybridScorer(index, semantic_weight=1.0, lexical_weight=0.0, nprobe=2)
+
+    [(sentence, score)] = scorer.top_k('anything', embeddings[1234], top_k=1)
+
+    assert sentence == 'condition 1234'
+    assert score > 0.99
+    assert len(scorer.candidates(embeddings[1234])) < len(sentences)
+
+
+def test_bm25_matches_the_formula():
+    documents = ['deposit paid by the buyer', 'buyer signs deed', 'deposit deposit refund', 'tenant pays rent']
+    vectorizer = CountVectorizer()
+    counts = vectorizer.fit_transform(documents)
+    k1, b = 1.2, 0.75
+    bm25 = BM25Index(counts, k1, b)
+
+    rows, scores = bm25.search(vectorizer.transform(['buyer deposit']), depth=10)
+
+    dense = counts.toarray().astype(float)
+    lengths = dense.sum(axis=1)
+    doc_freq = (dense > 0).sum(axis=0)
+    idf = np.log(1 + (len(documents) - doc_freq + 0.5) / (doc_freq + 0.5))
+    tf = dense[:, [vectorizer.vocabulary_['buyer'], vectorizer.vocabulary_['deposit']]]
+    idf = idf[[vectorizer.vocabulary_['buyer'], vectorizer.vocabulary_['deposit']]]
+    expected = (idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[:, None] / lengths.mean()))).sum(axis=1)
+    assert list(rows) == [i for i in np.argsort(-expected, kind='stable') if expected[i] > 0]
+    assert np.allclose(scores, expected[rows], rtol=1e-5)
+
+
+def test_bm25_without_known_terms_finds_nothing():
+    vectorizer = CountVectorizer()
+    bm25 = BM25Index(vectorizer.fit_transform(['buyer pays deposit']))
+
+    rows, scores = bm25.search(vectorizer.transform(['unrelated words']), depth=10)
+
+    assert len(rows) == 0 and len(scores) == 0
+
+
+def test_bm25_candidates_recall_the_lexical_top_matches():
+    sentences = word_sentences(3000)
+    index = random_index(sentences)
+    scorer = HybridScorer(index, semantic_weight=0.0, lexical_weight=1.0, bm25_depth=100)
+    exact = HybridScorer(index, semantic_weight=0.0, lexical_weight=1.0, bm25_depth=0)
+    assert scorer.bm25 is not None and exact.bm25 is None
+
+    rng = np.random.default_rng(1)
+    found = expected = 0
+    for row in rng.choice(len(sentences), 50, replace=False):
+        query = ' '.join(sentences[row].split()[:4])
+        best = {sentence for sentence, _ in exact.top_k(query, index.embeddings[row], top_k=5)}
+        found += len(best & {sentence for sentence, _ in scorer.top_k(query, index.embeddings[row], top_k=5)})
+        expected += len(best)
+
+    assert found / expected >= 0.9
+    assert scorer.candidates_scored < exact.candidates_scored
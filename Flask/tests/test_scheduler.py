@@ -0,0 +1,82 @@
+"""
+Change-driven training scheduler against LocalDropboxClient
+
+    python -m pytest tests
+"""
+
+import datetime
+import os
+import threading
+import time
+
+import pytest
+
+from app.local_dropbox import LocalDropboxClient
+from app.scheduler import TrainingScheduler, next_fallback_run, parse_fallback_schedule
+
+FOLDER = '/chatbot-training'
+
+
+def write(directory, name, text):
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return path
+
+
+@pytest.fixture
+def source(tmp_path):
+    return str(tmp_path)
+
+
+class RecordingJobs:
+    """The part of TrainingJobs the scheduler uses, recording submissions."""
+
+    def __init__(self):
+        self.active = None
+        self.submitted = []
+        self.event = threading.Event()
+
+    def submit(self, folder_path, force=False, trigger='api'):
+        self.submitted.append((trigger, time.monotonic()))
+        self.event.set()
+        return type('Job', (), {'id': str(len(self.submitted))})(), True
+
+
+def test_scheduler_debounces_a_burst_of_changes(source):
+    write(source, 'existing.txt', 'Already trained.')
+    client = LocalDropboxClient(source, FOLDER, poll_interval=0.02)
+    jobs = RecordingJobs()
+    debounce = 0.5
+    scheduler = TrainingScheduler(client, jobs, FOLDER, debounce=debounce, max_delay=30,
+                                  fallback=None, run_on_start=False).start()
+    try:
+        deadline = time.monotonic() + 5
+        while scheduler._cursor is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        for i in range(3):
+            write(source, f"upload{i}.txt", f"Uploaded condition {i}.")
+            time.sleep(debounce / 5)
+        last_write = time.monotonic()
+
+        assert jobs.event.wait(5)
+        # Let a second, wrongly debounced trigger show up if there is one
+        time.sleep(debounce * 2)
+    finally:
+        scheduler.stop(timeout=0.1)
+
+    assert [trigger for trigger, _ in jobs.submitted] == ['change']
+    assert jobs.submitted[0][1] >= last_write + debounce * 0.8
+    assert scheduler.changes_seen >= 3
+    assert scheduler.stats()['pending_changes'] == 0
+
+
+def test_fallback_schedule_runs_weekly():
+    schedule = parse_fallback_schedule('mon 09:00')
+    monday_morning = datetime.datetime(2026, 10, 12, 8, 0)
+
+    assert schedule == (0, 9, 0)
+    assert parse_fallback_schedule('off') is None
+    assert next_fallback_run(schedule, monday_morning) == datetime.datetime(2026, 10, 12, 9, 0)
+    assert next_fallback_run(schedule, monday_morning.replace(hour=9)) == datetime.datetime(2026, 10, 19, 9, 0)
@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+from app import create_app
+
+app = create_app()
+
+app.config['TRAINING_FOLDER'] = os.getenv('TRAINING_FOLDER', '/chatbot-training')